@@ -1,118 +1,225 @@
+import time
 import streamlit as st
 from datetime import datetime, timedelta
 import pandas as pd
 from config.firebase import db
 from application.billing_service import BillingService
-from utils.analysis import filter_billing
-
-def convert_str_to_datetime(date_str):
-    return datetime.strptime(date_str, '%Y-%m-%d')
-
-def fetch_all_performance_and_user_index(user_id, user_data, start_date, end_date):
-    # Add created_at to the data dictionary
-    data = {
+from application.run_snapshot_service import RunSnapshotService
+from infrastructure.performance_repository import PerformanceRepository
+from infrastructure.rollup_repository import RollupRepository
+from domain.performance import RUN_TYPE_LABELS
+from utils.analysis import FacetIndex
+from utils.concurrency import iter_fan_out, DEFAULT_MAX_WORKERS
+from utils.run_table import build_long_run_table, build_wide_run_table, compact_wide_run_table, USER_COLUMNS
+from utils.cache import LRUCache, TTLFetchCache, dataframe_nbytes
+
+LOAD_MODE_PER_USER = 'ユーザーごと'
+LOAD_MODE_COLLECTION_GROUP = 'コレクショングループ(一括)'
+LOAD_MODE_SNAPSHOT = 'ローカルスナップショット'
+RUN_DATA_CACHE_MAX_ENTRIES = 32
+RUN_DATA_CACHE_MAX_BYTES = 512 * 1024 * 1024  # 全セッション合計で保持する表示用DataFrameの上限
+DEFAULT_FETCH_CACHE_TTL_MINUTES = 10
+DEFAULT_BATCH_SIZE = 50  # 途中経過を表示するユーザー数の単位
+SORT_COLUMNS = ['Run Count Total', 'Display Name', 'UID']
+RENDER_INTERVAL_SECONDS = 1.0  # 途中経過の表を再描画する最小間隔
+
+def fetch_user_attributes(user_doc, billing_service):
+    user_id = user_doc.id
+    user_data = user_doc.to_dict()  # Get all user data including created_at
+
+    attributes = {
         'UID': user_id,
         'Display Name': user_data.get('display_name', 'Unknown User'),
         'Created At': user_data.get('created_at', 'Unknown'),  # Add created_at field
-        'Feed Run': {date_str.strftime('%Y-%m-%d'): 0 for date_str in pd.date_range(start_date, end_date)},
-        'Reel Run': {date_str.strftime('%Y-%m-%d'): 0 for date_str in pd.date_range(start_date, end_date)},
-        'Feed Theme Run': {date_str.strftime('%Y-%m-%d'): 0 for date_str in pd.date_range(start_date, end_date)},
-        'Reel Theme Run': {date_str.strftime('%Y-%m-%d'): 0 for date_str in pd.date_range(start_date, end_date)},
-        'Data Analysis Run': {date_str.strftime('%Y-%m-%d'): 0 for date_str in pd.date_range(start_date, end_date)}
+        'Plan': 'None',
+        'Billing Status': 'None',
+        'Feed Langsmith Project Name': 'None',
+        'Reel Langsmith Project Name': 'None'
     }
-    
-    performance_ref = db.collection('users').document(user_id).collection('performance')
-    performance_docs = performance_ref.stream()
-
-    for doc in performance_docs:
-        doc_id = doc.id
-        performance_data = doc.to_dict()
-        try:
-            date_obj = convert_str_to_datetime(doc_id)
-            date_str = date_obj.strftime('%Y-%m-%d')
-
-            data['Feed Run'][date_str] = performance_data.get('feed_run', 0)
-            data['Reel Run'][date_str] = performance_data.get('reel_run', 0)
-            data['Feed Theme Run'][date_str] = performance_data.get('feed_theme_run', 0)
-            data['Reel Theme Run'][date_str] = performance_data.get('reel_theme_run', 0)
-            data['Data Analysis Run'][date_str] = performance_data.get('data_analysis_run', 0)
-
-        except ValueError:
-            pass
 
     user_index_ref = db.collection('users').document(user_id).collection('user_index')
     user_index_docs = user_index_ref.stream()
 
     for doc in user_index_docs:
         user_index_data = doc.to_dict()
-        data[f"{doc.id.capitalize()} Langsmith Project Name"] = user_index_data.get('langsmith_project_name', 'None')
+        attributes[f"{doc.id.capitalize()} Langsmith Project Name"] = user_index_data.get('langsmith_project_name', 'None')
+
+    # Get billing information
+    billing_response = billing_service.get_current_billing(user_id, user_data)
+    if billing_response['status'] == 'success' and billing_response['billing_data']:
+        latest_billing = billing_response['billing_data']
+        attributes['Plan'] = latest_billing.get('plan', 'None')
+        attributes['Billing Status'] = latest_billing.get('status', 'None')
+
+    return attributes
+
+def fetch_user_run_data(user_doc, start_date, end_date, billing_service, include_performance=True):
+    """
+    ユーザー属性と、期間内の performance ドキュメントを (UID, 日付, データ) のレコードとして取得します。
+    """
+    attributes = fetch_user_attributes(user_doc, billing_service)
+
+    records = []
+    if include_performance:
+        performance_response = PerformanceRepository(user_doc.id).list_runs_between(start_date, end_date)
+        if performance_response['status'] != 'success':
+            raise RuntimeError(performance_response['message'])
+        records = [(user_doc.id, doc_id, performance_data) for doc_id, performance_data in performance_response['data'].items()]
+
+    return attributes, records
+
+def iter_all_users_run_data(start_date, end_date, max_workers=DEFAULT_MAX_WORKERS, load_mode=LOAD_MODE_PER_USER, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    全ユーザーの属性とラン数を並列に取得し、batch_size人ごとに順に返します。
+
+    load_mode が LOAD_MODE_COLLECTION_GROUP の場合、ラン数はユーザーごとのクエリではなく
+    全ユーザーの performance を横断する1本のコレクショングループクエリで取得し、最後のバッチとして返します。
+
+    Yields:
+        Tuple[pd.DataFrame, pd.DataFrame, List[Tuple[str, str]], int, int]: バッチのユーザー属性、縦持ちのラン数テーブル、
+        失敗したユーザーの (UID, エラーメッセージ)、処理済みのユーザー数、全ユーザー数。
+    """
+    if load_mode == LOAD_MODE_SNAPSHOT:
+        users, runs, failures = get_snapshot_run_data(start_date, end_date)
+        yield users, runs, failures, len(users), len(users)
+        return
 
-    return data
-
-def get_all_users_run_data(start_date, end_date):
     users_ref = db.collection('users')
-    users_docs = users_ref.stream()
+    users_docs = list(users_ref.stream())
+    total = len(users_docs)
 
+    include_performance = load_mode != LOAD_MODE_COLLECTION_GROUP
     billing_service = BillingService()
-    all_data = []
-    
-    for user_doc in users_docs:
-        user_id = user_doc.id
-        user_data = user_doc.to_dict()  # Get all user data including created_at
-
-        # Get performance and user index data
-        user_data_with_performance = fetch_all_performance_and_user_index(user_id, user_data, start_date, end_date)
-
-        # Get billing information
-        billing_response = billing_service.list_billing(user_id)
-        if billing_response['status'] == 'success':
-            billing_list = billing_response['billing_list']
-            if billing_list:
-                latest_billing = sorted(
-                    billing_list,
-                    key=lambda x: x.get('payment_date', datetime.min),
-                    reverse=True
-                )[0]
-                plan = latest_billing.get('plan', 'None')
-                status = latest_billing.get('status', 'None')
-            else:
-                plan = 'None'
-                status = 'None'
+    results, failures = [], []
+    processed = 0
+    for user_doc, result, error in iter_fan_out(
+        users_docs,
+        lambda user_doc: fetch_user_run_data(user_doc, start_date, end_date, billing_service, include_performance),
+        max_workers=max_workers
+    ):
+        processed += 1
+        if error is None:
+            results.append(result)
         else:
-            plan = 'None'
-            status = 'None'
-
-        user_data_with_performance['Plan'] = plan
-        user_data_with_performance['Billing Status'] = status
-        all_data.append(user_data_with_performance)
-
-    return all_data
-
-def prepare_dataframe_for_display(run_data, date_range):
+            failures.append((user_doc.id, error))
+
+        if processed % batch_size == 0 or processed == total:
+            users = pd.DataFrame([attributes for attributes, _ in results], columns=USER_COLUMNS)
+            runs = build_long_run_table(record for _, records in results for record in records)
+            yield users, runs, failures, processed, total
+            results, failures = [], []
+
+    if not include_performance:
+        runs = build_long_run_table(PerformanceRepository.stream_all_runs_between(start_date, end_date))
+        yield pd.DataFrame(columns=USER_COLUMNS), runs, [], total, total
+
+def collect_run_data(batches, on_batch=None):
+    """
+    iter_all_users_run_data のバッチをまとめて、(ユーザー属性, 縦持ちのラン数テーブル, 失敗したユーザー) を返します。
+    on_batch を指定した場合、バッチを受け取るたびに (ユーザー属性, ラン数テーブル, 処理済み人数, 全体人数) で呼び出します。
+    """
+    users_parts, runs_parts, all_failures = [], [], []
+    for users, runs, failures, processed, total in batches:
+        users_parts.append(users)
+        runs_parts.append(runs)
+        all_failures.extend(failures)
+        if on_batch is not None:
+            on_batch(users, runs, processed, total)
+
+    users = pd.concat(users_parts, ignore_index=True) if users_parts else pd.DataFrame(columns=USER_COLUMNS)
+    runs = pd.concat(runs_parts, ignore_index=True) if runs_parts else build_long_run_table([])
+    return users, runs, all_failures
+
+def get_all_users_run_data(start_date, end_date, max_workers=DEFAULT_MAX_WORKERS, load_mode=LOAD_MODE_PER_USER):
+    """
+    全ユーザーの属性とラン数を並列に取得します。
+
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, List[Tuple[str, str]]]: ユーザー取得順のユーザー属性、縦持ちのラン数テーブル、
+        失敗したユーザーの (UID, エラーメッセージ)。
+    """
+    return collect_run_data(iter_all_users_run_data(start_date, end_date, max_workers=max_workers, load_mode=load_mode))
+
+def get_snapshot_run_data(start_date, end_date):
+    """
+    ローカルスナップショットからラン数とユーザー属性を読み込みます。Firestoreへのアクセスは行いません。
+    """
+    runs, users = RunSnapshotService().load(start_date, end_date)
+    users = users[USER_COLUMNS].copy()
+    users['Created At'] = users['Created At'].astype(object).where(users['Created At'].notna(), 'Unknown')
+    return users, runs, []
+
+def refresh_run_snapshot(max_workers):
+    refresh_response = RunSnapshotService().refresh(max_workers=max_workers)
+    if refresh_response['status'] != 'success':
+        st.error(f"Failed to refresh run snapshot, Error: {refresh_response['message']}")
+        return
+    for user_id, error in refresh_response['failures']:
+        st.error(f"Failed to retrieve attributes for User ID: {user_id}, Error: {error}")
+
+def prepare_dataframe_for_display(users, runs, date_range):
+    return compact_wide_run_table(build_wide_run_table(runs, users, date_range), date_range)
+
+@st.cache_resource
+def get_run_data_cache():
+    """
+    表示用DataFrameとその絞り込み用インデックス(FacetIndex)をセッション間で共有するための、プロセスに1つのキャッシュを返します。
+    セッションにはキャッシュのキーだけを保存し、同じ条件のDataFrameを重複して保持しないようにします。
+    """
+    return LRUCache(max_entries=RUN_DATA_CACHE_MAX_ENTRIES, max_bytes=RUN_DATA_CACHE_MAX_BYTES, sizeof=lambda facet_index: facet_index.nbytes)
+
+def get_daily_rollup_totals(start_date, end_date, date_range):
+    """
+    ロールアップから全ユーザー合計の日次ラン数を取得します。日次の生データは読み込みません。
+    """
+    rollup_response = RollupRepository().get_daily_totals(start_date, end_date)
+    if rollup_response['status'] != 'success':
+        raise RuntimeError(rollup_response['message'])
+
+    totals = pd.DataFrame.from_dict(rollup_response['data'], orient='index')
+    totals = totals.reindex(index=date_range, columns=list(RUN_TYPE_LABELS)).fillna(0).astype(int)
+    totals = totals.rename(columns=RUN_TYPE_LABELS)
+    totals['Run Count Total'] = totals.sum(axis=1)
+    totals.index.name = 'Date'
+    return totals
+
+def get_monthly_rollup_totals(date_range):
+    """
+    ロールアップから、期間に含まれる月のユーザーごとの月次ラン数を取得します。月の途中から始まる期間でも、その月全体の合計です。
+    """
+    rollup_repo = RollupRepository()
     rows = []
+    for month in sorted({date_str[:7] for date_str in date_range}):
+        rollup_response = rollup_repo.list_monthly_totals(month)
+        if rollup_response['status'] != 'success':
+            raise RuntimeError(rollup_response['message'])
+        for user_id, counts in rollup_response['data'].items():
+            rows.append({'Month': month, 'UID': user_id, **{label: counts.get(run_type, 0) for run_type, label in RUN_TYPE_LABELS.items()}})
+
+    totals = pd.DataFrame(rows, columns=['Month', 'UID'] + list(RUN_TYPE_LABELS.values()))
+    totals['Run Count Total'] = totals[list(RUN_TYPE_LABELS.values())].sum(axis=1).astype(int)
+    return totals.sort_values(['Month', 'Run Count Total'], ascending=[True, False], kind='stable').reset_index(drop=True)
+
+@st.cache_resource
+def get_fetch_cache():
+    """
+    get_all_users_run_data の結果を (開始日, 終了日, 取得方法) をキーとして保持する、プロセスに1つのキャッシュを返します。
+    """
+    return TTLFetchCache(
+        ttl_seconds=DEFAULT_FETCH_CACHE_TTL_MINUTES * 60,
+        max_entries=RUN_DATA_CACHE_MAX_ENTRIES,
+        max_bytes=RUN_DATA_CACHE_MAX_BYTES,
+        sizeof=lambda result: dataframe_nbytes(result[0]) + dataframe_nbytes(result[1])
+    )
 
-    for user_data in run_data:
-        for run_type in ['Feed Run', 'Reel Run', 'Feed Theme Run', 'Reel Theme Run', 'Data Analysis Run']:
-            row = {
-                'UID': user_data['UID'],
-                'Display Name': user_data['Display Name'],
-                'Created At': user_data['Created At'],  # Add created_at to the row
-                'Run Type': run_type,
-                'Plan': user_data.get('Plan', 'None'),
-                'Billing Status': user_data.get('Billing Status', 'None'),
-                'Feed Langsmith Project Name': user_data.get('Feed Langsmith Project Name', 'None'),
-                'Reel Langsmith Project Name': user_data.get('Reel Langsmith Project Name', 'None')
-            }
-
-            for date_str in date_range:
-                row[date_str] = user_data[run_type].get(date_str, 0)
-
-            run_total = sum(user_data[run_type].get(date_str, 0) for date_str in date_range)
-            row['Run Count Total'] = run_total
-
-            rows.append(row)
+def sort_run_table(df, sort_column, descending):
+    if not sort_column:
+        return df
+    return df.sort_values(sort_column, ascending=not descending, kind='stable')
 
-    return pd.DataFrame(rows)
+def describe_fetch_status(hit, fetched_at):
+    status = "ヒット" if hit else "ミス"
+    return f"キャッシュ{status}: {(time.time() - fetched_at) / 60:.1f}分前に取得したデータです。"
 
 # Streamlit UI code remains the same
 st.set_page_config(page_title="Run Activity Dashboard", layout="wide")
@@ -124,40 +231,128 @@ with st.sidebar:
     start_date = st.date_input("開始日", value=datetime.now().date() - timedelta(days=7))
     end_date = st.date_input("終了日", value=datetime.now().date())
 
+    max_workers = st.number_input("同時取得数", min_value=1, max_value=64, value=DEFAULT_MAX_WORKERS)
+    load_mode = st.radio("ラン数の取得方法", options=[LOAD_MODE_PER_USER, LOAD_MODE_COLLECTION_GROUP, LOAD_MODE_SNAPSHOT])
+    refresh_snapshot_button = st.button("スナップショットを更新")
+    cache_ttl_minutes = st.number_input("キャッシュ有効期間 (分)", min_value=0, max_value=1440, value=DEFAULT_FETCH_CACHE_TTL_MINUTES)
+    force_refresh = st.checkbox("キャッシュを使わずに再取得")
+
     date_range = pd.date_range(start=start_date, end=end_date).strftime('%Y-%m-%d').tolist()
     submit_button = st.button("データを取得")
 
-if submit_button:
-    with st.spinner('データを取得中...'):
-        run_data = get_all_users_run_data(start_date, end_date)
+if refresh_snapshot_button:
+    with st.spinner('スナップショットを更新中...'):
+        refresh_run_snapshot(max_workers)
 
-        if not run_data:
-            st.warning("指定された日付範囲内にデータが見つかりませんでした。")
-            st.session_state['run_data_df'] = pd.DataFrame()
-        else:
-            run_data_df = prepare_dataframe_for_display(run_data, date_range)
-            st.session_state['run_data_df'] = run_data_df
-            st.success("データの取得が完了しました。")
+summary_container = st.container()
 
-if 'run_data_df' in st.session_state and not st.session_state['run_data_df'].empty:
-    st.subheader("絞り込みオプション")
+st.subheader("絞り込みオプション")
 
-    plan_options = ['feed', 'reel', 'both', 'internal', 'None']
-    selected_plans = st.multiselect("課金プランで絞り込む", options=plan_options, default=plan_options)
+plan_options = ['feed', 'reel', 'both', 'internal', 'None']
+selected_plans = st.multiselect("課金プランで絞り込む", options=plan_options, default=plan_options)
 
-    billing_status_options = ['active', 'cancelled', 'pending', 'None']
-    selected_billing_statuses = st.multiselect("課金ステータスで絞り込む", options=billing_status_options, default=billing_status_options)
+billing_status_options = ['active', 'cancelled', 'pending', 'None']
+selected_billing_statuses = st.multiselect("課金ステータスで絞り込む", options=billing_status_options, default=billing_status_options)
 
-    filtered_df = filter_billing(
-        df=st.session_state['run_data_df'],
-        plans=selected_plans if selected_plans else None,
-        statuses=selected_billing_statuses if selected_billing_statuses else None
-    )
+run_type_options = list(RUN_TYPE_LABELS.values())
+selected_run_types = st.multiselect("ラン種別で絞り込む", options=run_type_options, default=run_type_options)
+
+sort_column = st.selectbox("並び替え", options=[None] + SORT_COLUMNS, format_func=lambda column: column or "なし")
+sort_descending = st.checkbox("降順", value=True)
+
+selections = {
+    'Plan': selected_plans,
+    'Billing Status': selected_billing_statuses,
+    'Run Type': selected_run_types,
+}
+
+progress_placeholder = st.empty()
+table_placeholder = st.empty()
+
+if submit_button:
+    with st.spinner('データを取得中...'):
+        if load_mode == LOAD_MODE_SNAPSHOT and not RunSnapshotService().is_fresh():
+            refresh_run_snapshot(max_workers)
+
+        partial_frames = []
+        render_state = {'last_rendered_at': 0.0}
+
+        def render_batch(users, runs, processed, total):
+            # 取得済みのユーザーだけで表を作り、絞り込みと並び替えを適用して表示する
+            if not users.empty:
+                partial_frames.append(build_wide_run_table(runs, users, date_range))
+            progress_placeholder.progress(processed / total if total else 1.0, text=f"{processed} / {total} ユーザー取得済み")
+            if partial_frames and time.time() - render_state['last_rendered_at'] >= RENDER_INTERVAL_SECONDS:
+                render_state['last_rendered_at'] = time.time()
+                partial_df = FacetIndex(pd.concat(partial_frames, ignore_index=True)).filter(selections)
+                table_placeholder.dataframe(sort_run_table(partial_df, sort_column, sort_descending))
+
+        run_data_key = (start_date.isoformat(), end_date.isoformat(), load_mode)
+        fetch_result = get_fetch_cache().get_or_fetch(
+            run_data_key,
+            lambda: collect_run_data(
+                iter_all_users_run_data(start_date, end_date, max_workers=max_workers, load_mode=load_mode),
+                on_batch=render_batch
+            ),
+            ttl_seconds=cache_ttl_minutes * 60,
+            force_refresh=force_refresh
+        )
+        progress_placeholder.empty()
+        users, runs, failures = fetch_result.value
+        st.session_state['run_data_fetch_status'] = (fetch_result.hit, fetch_result.fetched_at)
+
+        with summary_container:
+            for user_id, error in failures:
+                st.error(f"Failed to retrieve run data for User ID: {user_id}, Error: {error}")
+
+            if users.empty:
+                st.warning("指定された日付範囲内にデータが見つかりませんでした。")
+                get_run_data_cache().put(run_data_key, FacetIndex(pd.DataFrame()))
+            else:
+                # キャッシュヒットで表示用DataFrameも残っていれば作り直さない
+                if not (fetch_result.hit and run_data_key in get_run_data_cache()):
+                    run_data_df = prepare_dataframe_for_display(users, runs, date_range)
+                    get_run_data_cache().put(run_data_key, FacetIndex(run_data_df))
+                st.success("データの取得が完了しました。")
+        st.session_state['run_data_key'] = run_data_key
+
+        # ロールアップを読めなくても、ユーザーごとの表はそのまま表示する
+        for state_key, load_totals in [
+            ('rollup_totals_df', lambda: get_daily_rollup_totals(start_date, end_date, date_range)),
+            ('monthly_rollup_totals_df', lambda: get_monthly_rollup_totals(date_range)),
+        ]:
+            try:
+                st.session_state[state_key] = load_totals()
+            except Exception as e:
+                st.session_state.pop(state_key, None)
+                with summary_container:
+                    st.error(f"Failed to retrieve run rollups, Error: {e}")
+
+with summary_container:
+    if 'run_data_fetch_status' in st.session_state:
+        st.caption(describe_fetch_status(*st.session_state['run_data_fetch_status']))
+
+    if 'rollup_totals_df' in st.session_state:
+        st.subheader("全ユーザー合計(日次)")
+        st.dataframe(st.session_state['rollup_totals_df'])
+
+    if 'monthly_rollup_totals_df' in st.session_state:
+        st.subheader("ユーザー別 月次合計")
+        st.dataframe(st.session_state['monthly_rollup_totals_df'], hide_index=True)
+
+facet_index = None
+if 'run_data_key' in st.session_state:
+    facet_index = get_run_data_cache().get(st.session_state['run_data_key'])
+    if facet_index is None:
+        table_placeholder.info("取得済みのデータがキャッシュから破棄されました。もう一度データを取得してください。")
+
+if facet_index is not None and not facet_index.df.empty:
+    filtered_df = sort_run_table(facet_index.filter(selections), sort_column, sort_descending)
 
     if filtered_df.empty:
-        st.warning("指定されたフィルタに該当するデータがありません。")
+        table_placeholder.warning("指定されたフィルタに該当するデータがありません。")
     else:
-        st.dataframe(filtered_df)
+        table_placeholder.dataframe(filtered_df)
 
         def convert_df(df):
             return df.to_csv(index=False).encode('utf-8')
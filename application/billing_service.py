@@ -1,8 +1,9 @@
 # services/billing_service.py
 from infrastructure.billing_repository import BillingRepository
 from domain.billing import Billing
+from domain.model_decoding import decode_model
 from typing import Dict, Any
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional
 
 
@@ -26,6 +27,8 @@ class BillingService:
             print(f"Creating billing object: {billing}")  # デバッグプリント
             response = self.billing_repo.create_or_update_billing(billing)
             print(f"Billing repository response: {response}")  # デバッグプリント
+            if response['status'] == 'success':
+                self.billing_repo.set_current_billing_if_latest(user_id, self.summarize_billing(billing.dict()))
             return response
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
@@ -39,7 +42,8 @@ class BillingService:
             billing_response = self.billing_repo.read_billing(user_id, billing_id)
             if billing_response['status'] == 'success':
                 billing_data = billing_response['billing_data']
-                billing = Billing(**billing_data)
+                # 保存済みのデータは検証せずに作成し、以下で変更するフィールドだけ validate_assignment で検証する
+                billing = decode_model(Billing, billing_data)
 
                 # 更新フィールドを設定
                 if plan is not None:
@@ -52,6 +56,8 @@ class BillingService:
                 print(f"Updating billing object: {billing}")  # デバッグプリント
                 update_response = self.billing_repo.update_billing(billing)
                 print(f"Billing repository update response: {update_response}")  # デバッグプリント
+                if update_response['status'] == 'success':
+                    self.billing_repo.set_current_billing_if_latest(user_id, self.summarize_billing(billing.dict()))
                 return update_response
             else:
                 return billing_response
@@ -59,7 +65,76 @@ class BillingService:
             return {'status': 'error', 'message': str(e)}
 
     def delete_billing(self, user_id: str, billing_id: str) -> Dict[str, Any]:
-        return self.billing_repo.delete_billing(user_id, billing_id)
+        response = self.billing_repo.delete_billing(user_id, billing_id)
+        if response['status'] == 'success':
+            # 削除したbillingが current_billing だった場合に備えて、残りのbillingから選び直す
+            self.refresh_current_billing(user_id)
+        return response
 
-    def list_billing(self, user_id: str) -> Dict[str, Any]:
-        return self.billing_repo.list_billing(user_id)
+    def list_billing(self, user_id: str, columnar: bool = False) -> Dict[str, Any]:
+        return self.billing_repo.list_billing(user_id, columnar=columnar)
+
+    def list_all_billing(self) -> Dict[str, Any]:
+        return self.billing_repo.list_all_billing()
+
+    def get_latest_billing(self, user_id: str) -> Dict[str, Any]:
+        """
+        payment_date が最も新しい billing を返します。billing が存在しない場合 billing_data は None です。
+        """
+        billing_response = self.list_billing(user_id)
+        if billing_response['status'] != 'success':
+            return billing_response
+        billing_list = billing_response['billing_list']
+        if not billing_list:
+            return {'status': 'success', 'billing_data': None}
+        latest_billing = max(
+            billing_list,
+            key=lambda x: x.get('payment_date') or datetime.min.replace(tzinfo=timezone.utc)
+        )
+        return {'status': 'success', 'billing_data': latest_billing}
+
+    def refresh_current_billing(self, user_id: str) -> Dict[str, Any]:
+        """
+        billing サブコレクションから最新のbillingを選び直し、ユーザードキュメントの current_billing に書き込みます。
+        """
+        latest_response = self.get_latest_billing(user_id)
+        if latest_response['status'] != 'success':
+            return latest_response
+        latest_billing = latest_response['billing_data']
+        return self.billing_repo.set_current_billing(user_id, self.summarize_billing(latest_billing) if latest_billing else None)
+
+    def backfill_current_billing(self) -> Dict[str, Any]:
+        """
+        全ユーザーの current_billing を billing サブコレクションから求め直して書き込みます。
+        current_billing の導入前に作られたユーザーや、非正規化がずれたユーザーを一度に揃えるためのものです。
+        billing は list_all_billing の1本のクエリで読み込みます。
+        """
+        billing_response = self.list_all_billing()
+        if billing_response['status'] != 'success':
+            return billing_response
+        latest_by_user = {}
+        for billing_data in billing_response['billing_list']:
+            user_id = billing_data['user_id']
+            latest = latest_by_user.get(user_id)
+            if latest is None or BillingRepository._payment_date_key(billing_data) > BillingRepository._payment_date_key(latest):
+                latest_by_user[user_id] = billing_data
+        current_billing_by_user = {user_id: self.summarize_billing(billing_data) for user_id, billing_data in latest_by_user.items()}
+        return self.billing_repo.backfill_current_billing(current_billing_by_user)
+
+    def get_current_billing(self, user_id: str, user_data: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        users ストリームで取得したユーザードキュメントの current_billing を返します。
+        current_billing をまだ持たないユーザーの場合だけ、billing サブコレクションから求めます。
+        """
+        if BillingRepository.CURRENT_BILLING_FIELD in user_data:
+            return {'status': 'success', 'billing_data': user_data[BillingRepository.CURRENT_BILLING_FIELD]}
+        return self.get_latest_billing(user_id)
+
+    @staticmethod
+    def summarize_billing(billing_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            'billing_id': billing_data.get('billing_id'),
+            'plan': billing_data.get('plan'),
+            'status': billing_data.get('status'),
+            'payment_date': billing_data.get('payment_date'),
+        }
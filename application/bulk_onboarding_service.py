@@ -0,0 +1,227 @@
+# application/bulk_onboarding_service.py
+import csv
+import io
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from config.firebase import db
+from application.billing_service import BillingService
+from domain.billing import Billing
+from domain.model_decoding import decode_model
+from domain.user import User
+from infrastructure.billing_repository import BillingRepository
+from infrastructure.email_index import get_email_index
+from infrastructure.user_repository import UserRepository
+from utils.concurrency import RateLimiter, iter_fan_out
+
+ONBOARDING_COLUMNS = [
+    'email', 'password', 'display_name', 'role', 'instagram_username',
+    'plan', 'status', 'payment_date', 'cancellation_date',
+]
+DEFAULT_SIGN_UP_RATE_PER_SECOND = 10  # Identity Toolkit へのサインアップ要求の上限
+DEFAULT_SIGN_UP_WORKERS = 8
+DEFAULT_MAX_WRITE_ATTEMPTS = 5  # BulkWriter が1件の書き込みを試す最大回数(再試行は指数バックオフ)
+USER_COLUMNS = ['email', 'display_name', 'role', 'instagram_username']
+DEFAULT_ROLE = 'user'  # role 列のない新規ユーザーの役割
+
+
+def parse_onboarding_rows(content: str, file_format: str) -> List[Dict[str, Any]]:
+    """
+    CSV(ヘッダー行あり)または JSONL(1行1オブジェクト)の文字列を、ONBOARDING_COLUMNS をキーとする辞書のリストにします。
+    空の値はNoneになります。
+    """
+    if file_format == 'csv':
+        records = list(csv.DictReader(io.StringIO(content)))
+    elif file_format == 'jsonl':
+        records = [json.loads(line) for line in content.splitlines() if line.strip()]
+    else:
+        raise ValueError(f"Unsupported format: {file_format}")
+    return [{column: (record.get(column) or None) for column in ONBOARDING_COLUMNS} for record in records]
+
+
+class BulkOnboardingService:
+    """
+    ユーザーと billing をまとめて登録します。
+
+    1. 各行を User / Billing として検証します。登録済みのユーザーの行は、ファイルにある列だけを検証します。
+    2. 登録済みでないメールアドレスは、Identity Toolkit へのサインアップを RateLimiter で流量を抑えながら並列に行います。
+    3. ユーザー、billing、current_billing の書き込みは BulkWriter に渡し、失敗した書き込みは指数バックオフで再試行します。
+       登録済みのユーザーはファイルにある列だけを更新し、current_billing は BulkWriter の完了後に
+       set_current_billing_if_latest で、既存より新しい場合にだけ書き換えます。
+
+    結果は行ごとに {'row', 'email', 'status', 'user_id', 'billing_id', 'message'} の辞書で返します。
+    """
+    def __init__(self,
+                 sign_up_rate_per_second: float = DEFAULT_SIGN_UP_RATE_PER_SECOND,
+                 sign_up_workers: int = DEFAULT_SIGN_UP_WORKERS,
+                 max_write_attempts: int = DEFAULT_MAX_WRITE_ATTEMPTS):
+        self.user_repo = UserRepository()
+        self.billing_repo = BillingRepository()
+        self.email_index = get_email_index()
+        self.rate_limiter = RateLimiter(sign_up_rate_per_second, burst=sign_up_workers)
+        self.sign_up_workers = sign_up_workers
+        self.max_write_attempts = max_write_attempts
+
+    def import_rows(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        results = [{'row': i + 1, 'email': row.get('email'), 'status': 'pending', 'user_id': None, 'billing_id': None, 'message': None}
+                   for i, row in enumerate(rows)]
+
+        # 登録済みのユーザーはサインアップせずに既存のUIDへ書き込む
+        prepared = []
+        to_sign_up = []
+        existing_rows = set()
+        for result, row in zip(results, rows):
+            if not row.get('email'):
+                self._fail(result, 'email is required')
+                continue
+            try:
+                user = self._build_partial_user(row)
+            except Exception as e:
+                self._fail(result, f"Invalid row: {e}")
+                continue
+            try:
+                user_id = self.email_index.get(user.email)
+            except Exception as e:
+                self._fail(result, f"Email lookup failed: {e}")
+                continue
+            try:
+                if user_id is None:
+                    user = self._build_user(row)
+                item = (result, row, user, self._build_billing(row))
+            except Exception as e:
+                self._fail(result, f"Invalid row: {e}")
+                continue
+            if user_id is not None:
+                result['user_id'] = user_id
+                existing_rows.add(result['row'])
+                prepared.append(item)
+            elif not row.get('password'):
+                self._fail(result, 'password is required for new users')
+            else:
+                to_sign_up.append(item)
+                prepared.append(item)
+
+        for (result, _, _, _), response, error in iter_fan_out(to_sign_up, self._sign_up, self.sign_up_workers):
+            if error is not None:
+                self._fail(result, f"Sign up failed: {error}")
+            elif response['status'] != 'success':
+                self._fail(result, f"Sign up failed: {response['message']}")
+            else:
+                result['user_id'] = response['user_id']
+
+        self._write_documents([item for item in prepared if item[0]['status'] == 'pending'], existing_rows)
+        return results
+
+    def _sign_up(self, item) -> Dict[str, Any]:
+        _, row, user, _ = item
+        self.rate_limiter.acquire()
+        return self.user_repo.sign_up(user.email, row['password'])
+
+    def _write_documents(self, items, existing_rows) -> None:
+        result_by_path = {}
+        bulk_writer = db.bulk_writer()
+
+        def on_error(error, _bulk_writer) -> bool:
+            # Trueを返すと BulkWriter がバックオフして再試行する
+            if error.attempts < self.max_write_attempts:
+                return True
+            result = result_by_path.get(error.operation.reference.path)
+            if result is not None:
+                self._fail(result, f"Write failed after {error.attempts} attempts: {error.message}")
+            return False
+
+        bulk_writer.on_write_error(on_error)
+        existing_billing = []
+        for result, row, user, billing in items:
+            user_id = result['user_id']
+            is_existing = result['row'] in existing_rows
+            user.user_id = user_id
+            if is_existing:
+                # 登録済みのユーザーはファイルにある列だけを書き込み、作成日時や省略された列は上書きしない
+                user_data = user.dict(include={column for column in USER_COLUMNS if row.get(column) is not None})
+            else:
+                user_data = user.dict()
+            user_ref = db.collection('users').document(user_id)
+            if billing is not None:
+                billing.user_id = user_id
+                billing_ref = user_ref.collection(BillingRepository.SUBCOLLECTION_NAME).document(billing.billing_id)
+                bulk_writer.set(billing_ref, billing.dict())
+                result_by_path[billing_ref.path] = result
+                result['billing_id'] = billing.billing_id
+                if is_existing:
+                    existing_billing.append((result, billing))
+                else:
+                    user_data[BillingRepository.CURRENT_BILLING_FIELD] = BillingService.summarize_billing(billing.dict())
+            bulk_writer.set(user_ref, user_data, merge=True)
+            result_by_path[user_ref.path] = result
+        bulk_writer.close()
+
+        # 登録済みのユーザーは、既存の current_billing より新しい場合にだけ書き換える
+        existing_billing = [(result, billing) for result, billing in existing_billing if result['status'] == 'pending']
+        for (result, _), response, error in iter_fan_out(existing_billing, self._set_current_billing):
+            if error is not None:
+                self._fail(result, f"current_billing update failed: {error}")
+            elif response['status'] != 'success':
+                self._fail(result, f"current_billing update failed: {response['message']}")
+
+        for result, _, user, _ in items:
+            if result['status'] == 'pending':
+                result['status'] = 'success'
+                self.email_index.set(user.email, result['user_id'])
+
+    def _set_current_billing(self, item) -> Dict[str, Any]:
+        result, billing = item
+        return self.billing_repo.set_current_billing_if_latest(result['user_id'], BillingService.summarize_billing(billing.dict()))
+
+    @staticmethod
+    def _build_user(row: Dict[str, Any]) -> User:
+        return User(
+            email=row.get('email'),
+            display_name=row.get('display_name'),
+            role=row.get('role') or DEFAULT_ROLE,
+            instagram_username=row.get('instagram_username'),
+        )
+
+    @staticmethod
+    def _build_partial_user(row: Dict[str, Any]) -> User:
+        # 登録済みのユーザーは必須の列が揃っていなくてもよいため、ファイルにある列だけを代入時のバリデーションで検証する
+        user = decode_model(User, {})
+        for column in USER_COLUMNS:
+            if row.get(column) is not None:
+                setattr(user, column, row[column])
+        return user
+
+    @staticmethod
+    def _build_billing(row: Dict[str, Any]) -> Optional[Billing]:
+        if not row.get('plan'):
+            return None
+        cancellation_date = _parse_datetime(row.get('cancellation_date'))
+        return Billing(
+            billing_id=str(uuid.uuid4()),
+            user_id='pending',  # サインアップ後にUIDで置き換える
+            plan=row['plan'],
+            status=row.get('status') or _billing_status(cancellation_date),
+            payment_date=_parse_datetime(row.get('payment_date')),
+            cancellation_date=cancellation_date,
+        )
+
+    @staticmethod
+    def _fail(result: Dict[str, Any], message: str) -> None:
+        result['status'] = 'error'
+        result['message'] = message
+
+
+def _billing_status(cancellation_date: Optional[datetime]) -> str:
+    # status 列がない場合は、解約日を過ぎていれば 'cancelled'、それ以外は 'active' とする
+    if cancellation_date is not None and cancellation_date <= datetime.now(timezone.utc):
+        return 'cancelled'
+    return 'active'
+
+
+def _parse_datetime(value: Optional[str]) -> Optional[datetime]:
+    if value is None:
+        return None
+    parsed = datetime.fromisoformat(str(value))
+    # タイムゾーンのない日時はUTCとして扱う
+    return parsed if parsed.tzinfo is not None else parsed.replace(tzinfo=timezone.utc)
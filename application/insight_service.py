@@ -1,18 +1,21 @@
 # application/insight_service.py
 
 import uuid
+import logging
+import pydantic
+import pyarrow as pa
 from datetime import datetime
 from infrastructure.insight_repository import InsightRepository
 from domain.insight import Insight
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterator, Union
 
 class InsightService:
     def __init__(self):
         self.repository = InsightRepository()
 
-    def get_all_insights(self) -> List[Insight]:
+    def get_all_insights(self, validate: bool = False) -> List[Insight]:
         try:
-            return self.repository.get_all_insights()
+            return self.repository.get_all_insights(validate=validate)
         except pydantic.ValidationError as e:
             logging.error(f"Pydantic validation error: {e}")
             logging.error(f"Pydantic version: {pydantic.__version__}")
@@ -21,8 +24,8 @@ class InsightService:
             logging.error(f"Unexpected error in get_all_insights: {e}")
             raise
 
-    def update_insight(self, user_id: str, insight: Insight) -> Dict[str, Any]:
-        return self.repository.update_insight(user_id, insight)
+    def stream_all_insights(self, **kwargs) -> Iterator[Union[List[Union[Insight, Dict[str, Any]]], pa.RecordBatch]]:
+        return self.repository.stream_all_insights(**kwargs)
 
     def get_user_ids(self) -> List[str]:
         return self.repository.get_user_ids()
@@ -30,8 +33,11 @@ class InsightService:
     def create_new_insight(self, insight: Insight) -> Dict[str, Any]:
         return self.repository.create_insight(insight)
 
-    def get_insights_by_user(self, user_id: str) -> List[Insight]:
-        return self.repository.get_insights_by_user(user_id)
+    def get_insights_by_user(self, user_id: str, columnar: bool = False) -> Union[List[Insight], pa.Table]:
+        return self.repository.get_insights_by_user(user_id, columnar=columnar)
+
+    def stream_insights_by_user(self, user_id: str, **kwargs) -> Iterator[Union[Insight, Dict[str, Any]]]:
+        return self.repository.stream_insights_by_user(user_id, **kwargs)
 
     def update_insight(self, insight: Insight) -> Dict[str, Any]:
         return self.repository.update_insight(insight)
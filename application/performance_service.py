@@ -1,24 +1,31 @@
 import datetime
+from application.run_log_buffer import get_run_log_buffer
 from infrastructure.performance_repository import PerformanceRepository
 
 class PerformanceService:
-    def __init__(self, user_id: str):
-        self.repository = PerformanceRepository(user_id)
+    def __init__(self, user_id: str, buffered: bool = False, num_shards: int = 1):
+        """
+        buffered=True の場合、ラン数の記録はプロセス共通の RunLogBuffer に積まれ、バックグラウンドでまとめて書き込まれます。
+        num_shards は同期的に記録する場合の日次ドキュメントのシャード数です(PerformanceRepository を参照)。
+        """
+        self.user_id = user_id
+        self.repository = PerformanceRepository(user_id, num_shards=num_shards)
+        self.buffer = get_run_log_buffer() if buffered else None
 
     def log_feed_run(self, date: datetime.date, count: int = 1):
-        return self.repository.log_run('feed_run', date, count)
+        return self._log_run('feed_run', date, count)
 
     def log_reel_run(self, date: datetime.date, count: int = 1):
-        return self.repository.log_run('reel_run', date, count)
+        return self._log_run('reel_run', date, count)
 
     def log_feed_theme_run(self, date: datetime.date, count: int = 1):
-        return self.repository.log_run('feed_theme_run', date, count)
+        return self._log_run('feed_theme_run', date, count)
 
     def log_reel_theme_run(self, date: datetime.date, count: int = 1):
-        return self.repository.log_run('reel_theme_run', date, count)
+        return self._log_run('reel_theme_run', date, count)
 
     def log_data_analysis_run(self, date: datetime.date, count: int = 1):
-        return self.repository.log_run('data_analysis_run', date, count)
+        return self._log_run('data_analysis_run', date, count)
 
     def get_feed_run_count(self, date: datetime.date):
         return self.repository.get_run_count('feed_run', date)
@@ -28,3 +35,9 @@ class PerformanceService:
 
     def list_all_runs(self, date: datetime.date):
         return self.repository.list_all_runs(date)
+
+    def _log_run(self, run_type: str, date: datetime.date, count: int):
+        # バッファが満杯で受け付けられなかった場合は、記録を失わないよう同期的に書き込む
+        if self.buffer is not None and self.buffer.add(self.user_id, run_type, date, count):
+            return {'status': 'success', 'date': date.strftime('%Y-%m-%d'), 'buffered': True}
+        return self.repository.log_run(run_type, date, count)
@@ -1,6 +1,14 @@
+import copy
 from infrastructure.prompt_repository import PromptRepository
 from domain.prompt import Prompt
 from typing import Dict, Any, Optional
+from utils.cache import TTLFetchCache
+
+PROMPT_CACHE_TTL_SECONDS = 300
+PROMPT_CACHE_MAX_ENTRIES = 1024
+
+# (user_id, type) ごとの read_prompt の結果を保持する、プロセスに1つのキャッシュ
+_prompt_cache = TTLFetchCache(ttl_seconds=PROMPT_CACHE_TTL_SECONDS, max_entries=PROMPT_CACHE_MAX_ENTRIES)
 
 
 class PromptService:
@@ -17,10 +25,17 @@ class PromptService:
             example_plot=example_plot
         )
         prompt.embed_example_plot()
-        return self.prompt_repo.create_prompt(prompt)
+        result = self.prompt_repo.create_prompt(prompt)
+        _prompt_cache.invalidate((user_id, type))
+        return result
 
     def read_prompt(self, user_id: str, type: str) -> Dict[str, Any]:
-        prompt = self.prompt_repo.read_prompt(user_id, type)
+        """
+        プロンプトをキャッシュ経由で読み込みます。キャッシュは create/update/delete で同期的に破棄されます。
+        """
+        cached = _prompt_cache.get_or_fetch((user_id, type), lambda: self.prompt_repo.read_prompt(user_id, type))
+        # キャッシュした値を書き換えないよう、コピーに対して整形する
+        prompt = copy.deepcopy(cached.value)
         prompt["data"]["text"] = self.format_prompt(prompt["data"]["text"], prompt["data"]["example_plot"])
         return prompt
 
@@ -33,13 +48,21 @@ class PromptService:
             example_plot=example_plot
         )
         prompt.embed_example_plot()
-        return self.prompt_repo.update_prompt(prompt)
+        result = self.prompt_repo.update_prompt(prompt)
+        _prompt_cache.invalidate((user_id, type))
+        return result
 
     def delete_prompt(self, user_id: str, type: str) -> Dict[str, Any]:
-        return self.prompt_repo.delete_prompt(user_id, type)
+        result = self.prompt_repo.delete_prompt(user_id, type)
+        _prompt_cache.invalidate((user_id, type))
+        return result
+
+    def list_prompts(self, user_id: str, columnar: bool = False) -> Dict[str, Any]:
+        return self.prompt_repo.list_prompts(user_id, columnar=columnar)["data"]
 
-    def list_prompts(self, user_id: str) -> Dict[str, Any]:
-        return self.prompt_repo.list_prompts(user_id)["data"]
+    @staticmethod
+    def cache_stats() -> Dict[str, Any]:
+        return _prompt_cache.stats()
 
     def format_prompt(self, text: str, example_plot: str) -> str:
         if '{example_plot}' in text:
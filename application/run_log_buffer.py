@@ -0,0 +1,130 @@
+# application/run_log_buffer.py
+import atexit
+import logging
+import queue
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Tuple
+from infrastructure.performance_repository import PerformanceRepository
+
+DEFAULT_FLUSH_INTERVAL_SECONDS = 5.0
+DEFAULT_FLUSH_THRESHOLD = 100  # この数の (UID, 日付) が溜まったら間隔を待たずに書き込む
+DEFAULT_MAX_QUEUE_SIZE = 10000
+DEFAULT_PUT_TIMEOUT_SECONDS = 1.0
+
+
+class RunLogBuffer:
+    """
+    ラン数の記録をメモリ上で (UID, 日付, ラン種別) ごとに集約し、バックグラウンドスレッドでまとめて書き込みます。
+
+    記録は上限付きのキューに積むだけなので、呼び出し側はFirestoreへの往復を待たずに戻ります。
+    キューが満杯の間は add が最大 put_timeout 秒待ち、それでも空かなければFalseを返します。
+    書き込みは flush_interval 秒ごと、または集約中の (UID, 日付) が flush_threshold に達した時点で行い、
+    1バッチに最大 flush_threshold 組の (UID, 日付) を含めます。失敗したバッチの加算は次回の書き込みに持ち越します。
+    プロセス終了時には atexit で残りを書き込みます。
+    """
+    def __init__(self,
+                 flush_interval: float = DEFAULT_FLUSH_INTERVAL_SECONDS,
+                 flush_threshold: int = DEFAULT_FLUSH_THRESHOLD,
+                 max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+                 put_timeout: float = DEFAULT_PUT_TIMEOUT_SECONDS):
+        self.flush_interval = flush_interval
+        self.flush_threshold = max(1, flush_threshold)
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._pending = defaultdict(int)
+        self._pending_user_dates = set()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='run-log-buffer', daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def add(self, user_id: str, run_type: str, date: datetime.date, count: int = 1) -> bool:
+        """
+        ラン数の加算をキューに積みます。キューが満杯のまま put_timeout 秒が過ぎた場合、または停止後はFalseを返します。
+        """
+        if self._stopped.is_set():
+            return False
+        try:
+            self._queue.put((user_id, date.strftime('%Y-%m-%d'), run_type, count), timeout=self.put_timeout)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self) -> None:
+        """
+        バックグラウンドスレッドを止め、キューと集約中の加算をすべて書き込みます。
+        """
+        if self._stopped.is_set():
+            return
+        self._stopped.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        next_flush = time.monotonic() + self.flush_interval
+        # 書き込みに失敗している間は件数によらず flush_interval ごとにだけ再試行する
+        last_flush_ok = True
+        while not self._stopped.is_set():
+            try:
+                self._coalesce(self._queue.get(timeout=max(0.0, next_flush - time.monotonic())))
+            except queue.Empty:
+                pass
+            if (last_flush_ok and len(self._pending_user_dates) >= self.flush_threshold) or time.monotonic() >= next_flush:
+                last_flush_ok = self._flush()
+                next_flush = time.monotonic() + self.flush_interval
+        self._drain()
+        self._flush()
+
+    def _coalesce(self, item: Tuple[str, str, str, int]) -> None:
+        user_id, date_str, run_type, count = item
+        self._pending[(user_id, date_str, run_type)] += count
+        self._pending_user_dates.add((user_id, date_str))
+
+    def _drain(self) -> None:
+        while True:
+            try:
+                self._coalesce(self._queue.get_nowait())
+            except queue.Empty:
+                return
+
+    def _flush(self) -> bool:
+        # キューに溜まっている分も取り込んでから書き込む
+        self._drain()
+        pending, self._pending = self._pending, defaultdict(int)
+        self._pending_user_dates = set()
+        ok = True
+        for chunk in self._chunks(pending):
+            try:
+                PerformanceRepository.write_run_increments(chunk)
+            except Exception as e:
+                ok = False
+                logging.error(f"Failed to write {len(chunk)} run increments, retrying on next flush: {e}")
+                for (user_id, date_str, run_type), count in chunk.items():
+                    self._coalesce((user_id, date_str, run_type, count))
+        return ok
+
+    def _chunks(self, pending: Dict[Tuple[str, str, str], int]):
+        # 同じ (UID, 日付) の加算は同じバッチに入れ、1バッチあたりの (UID, 日付) を flush_threshold 組までにする
+        by_user_date = defaultdict(dict)
+        for (user_id, date_str, run_type), count in pending.items():
+            by_user_date[(user_id, date_str)][(user_id, date_str, run_type)] = count
+        groups = list(by_user_date.values())
+        for i in range(0, len(groups), self.flush_threshold):
+            yield {key: count for group in groups[i:i + self.flush_threshold] for key, count in group.items()}
+
+
+_default_buffer = None
+_default_buffer_lock = threading.Lock()
+
+
+def get_run_log_buffer() -> RunLogBuffer:
+    """
+    プロセスに1つの RunLogBuffer を返します。初回の呼び出しで作成します。
+    """
+    global _default_buffer
+    with _default_buffer_lock:
+        if _default_buffer is None:
+            _default_buffer = RunLogBuffer()
+        return _default_buffer
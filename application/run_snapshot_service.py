@@ -0,0 +1,112 @@
+# application/run_snapshot_service.py
+import pandas as pd
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Tuple
+from config.firebase import db
+from application.billing_service import BillingService
+from application.user_index_service import UserIndexService
+from infrastructure.performance_repository import PerformanceRepository
+from infrastructure.run_snapshot_repository import RunSnapshotRepository
+from utils.concurrency import fan_out, DEFAULT_MAX_WORKERS
+from utils.run_table import build_long_run_table
+
+USER_ATTRIBUTE_COLUMNS = [
+    'UID', 'Display Name', 'Created At', 'Plan', 'Billing Status', 'Payment Date',
+    'Feed Langsmith Project Name', 'Reel Langsmith Project Name',
+]
+
+
+class RunSnapshotService:
+    """
+    ラン数のローカルスナップショットを差分更新し、ダッシュボードに提供します。
+    """
+    def __init__(self, snapshot_repo: RunSnapshotRepository = None):
+        self.snapshot_repo = snapshot_repo or RunSnapshotRepository()
+        self.billing_service = BillingService()
+        self.user_index_service = UserIndexService()
+
+    def is_fresh(self) -> bool:
+        """
+        スナップショットが前日分までを取り込んでいる場合にTrueを返します。
+        """
+        last_complete_day = (datetime.now().date() - timedelta(days=1)).strftime('%Y-%m-%d')
+        high_water_mark = self.snapshot_repo.get_high_water_mark()
+        return high_water_mark is not None and high_water_mark >= last_complete_day
+
+    def refresh(self, max_workers: int = DEFAULT_MAX_WORKERS) -> Dict[str, Any]:
+        """
+        high water mark 以降の日付のラン数だけをFirestoreから取得してスナップショットにマージします。
+        スナップショットが存在しない場合は全期間を取り込みます。ユーザー属性は毎回取り直します。
+        """
+        try:
+            high_water_mark = self.snapshot_repo.get_high_water_mark()
+            today = datetime.now().date()
+            last_complete_day = (today - timedelta(days=1)).strftime('%Y-%m-%d')
+
+            if high_water_mark is None:
+                runs = build_long_run_table(PerformanceRepository.stream_all_runs())
+            else:
+                start_date = datetime.strptime(high_water_mark, '%Y-%m-%d').date()
+                new_runs = build_long_run_table(PerformanceRepository.stream_all_runs_between(start_date, today))
+                runs = self.snapshot_repo.load_runs()
+                runs = pd.concat([runs[runs['Date'] < high_water_mark], new_runs], ignore_index=True)
+
+            users, failures = self._fetch_user_attributes(max_workers)
+            self.snapshot_repo.save(self._compact_runs(runs), users, last_complete_day)
+            return {'status': 'success', 'high_water_mark': last_complete_day, 'failures': failures}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def load(self, start_date: datetime.date = None, end_date: datetime.date = None) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        """
+        スナップショットから (ラン数の縦持ちテーブル, ユーザー属性) を読み込みます。
+        start_date / end_date を指定した場合、ラン数はその期間(両端を含む)に絞り込みます。
+        """
+        runs = self.snapshot_repo.load_runs()
+        if start_date is not None:
+            runs = runs[runs['Date'] >= start_date.strftime('%Y-%m-%d')]
+        if end_date is not None:
+            runs = runs[runs['Date'] <= end_date.strftime('%Y-%m-%d')]
+        return runs.reset_index(drop=True), self.snapshot_repo.load_users()
+
+    def _fetch_user_attributes(self, max_workers: int) -> Tuple[pd.DataFrame, List[Tuple[str, str]]]:
+        users_docs = list(db.collection('users').stream())
+        rows, failures = fan_out(users_docs, self._fetch_user_attribute_row, max_workers=max_workers)
+        users = pd.DataFrame(rows, columns=USER_ATTRIBUTE_COLUMNS)
+        users['Created At'] = pd.to_datetime(users['Created At'], errors='coerce', utc=True)
+        users['Payment Date'] = pd.to_datetime(users['Payment Date'], errors='coerce', utc=True)
+        return users, [(user_doc.id, error) for user_doc, error in failures]
+
+    def _fetch_user_attribute_row(self, user_doc) -> Dict[str, Any]:
+        user_id = user_doc.id
+        user_data = user_doc.to_dict()
+        row = {
+            'UID': user_id,
+            'Display Name': user_data.get('display_name', 'Unknown User'),
+            'Created At': user_data.get('created_at'),
+            'Plan': 'None',
+            'Billing Status': 'None',
+            'Payment Date': None,
+            'Feed Langsmith Project Name': 'None',
+            'Reel Langsmith Project Name': 'None',
+        }
+
+        user_index_response = self.user_index_service.list_user_indices(user_id)
+        for user_index_data in user_index_response['data']:
+            # index_id は保存されたフィールド('{uid}_{type}')で上書きされるため、ドキュメントIDと同じ type から列名を作る
+            row[f"{user_index_data.get('type', '').capitalize()} Langsmith Project Name"] = user_index_data.get('langsmith_project_name', 'None')
+
+        billing_response = self.billing_service.get_current_billing(user_id, user_data)
+        if billing_response['status'] != 'success':
+            raise RuntimeError(billing_response['message'])
+        latest_billing = billing_response['billing_data']
+        if latest_billing:
+            row['Plan'] = latest_billing.get('plan', 'None')
+            row['Billing Status'] = latest_billing.get('status', 'None')
+            row['Payment Date'] = latest_billing.get('payment_date')
+        return row
+
+    @staticmethod
+    def _compact_runs(runs: pd.DataFrame) -> pd.DataFrame:
+        # UID と Run Type は辞書エンコードされたArrow列として保存される
+        return runs.astype({'UID': 'category', 'Date': str, 'Run Type': 'category', 'Count': 'int64'})
@@ -1,6 +1,14 @@
+import copy
 from infrastructure.user_index_repository import UserIndexRepository
 from domain.user_index import UserIndex
 from typing import Dict, Any
+from utils.cache import TTLFetchCache
+
+USER_INDEX_CACHE_TTL_SECONDS = 300
+USER_INDEX_CACHE_MAX_ENTRIES = 1024
+
+# (user_id, type) ごとの read_user_index の結果を保持する、プロセスに1つのキャッシュ
+_user_index_cache = TTLFetchCache(ttl_seconds=USER_INDEX_CACHE_TTL_SECONDS, max_entries=USER_INDEX_CACHE_MAX_ENTRIES)
 
 class UserIndexService:
     def __init__(self):
@@ -16,10 +24,16 @@ class UserIndexService:
             pinecone_api_key=pinecone_api_key,
             type=type
         )
-        return self.user_index_repo.create_user_index(user_index)
+        result = self.user_index_repo.create_user_index(user_index)
+        _user_index_cache.invalidate((user_id, type))
+        return result
 
     def read_user_index(self, user_id: str, type: str) -> Dict[str, Any]:
-        return self.user_index_repo.read_user_index(user_id, type)
+        """
+        ユーザーインデックスをキャッシュ経由で読み込みます。キャッシュは create/update/delete で同期的に破棄されます。
+        """
+        cached = _user_index_cache.get_or_fetch((user_id, type), lambda: self.user_index_repo.read_user_index(user_id, type))
+        return copy.deepcopy(cached.value)
 
     def update_user_index(self, index_id: str, user_id: str, index_name: str, langsmith_project_name: str, pinecone_api_key: str, type: str) -> Dict[str, Any]:
         user_index = UserIndex(
@@ -30,10 +44,18 @@ class UserIndexService:
             pinecone_api_key=pinecone_api_key,
             type=type
         )
-        return self.user_index_repo.update_user_index(user_index)
+        result = self.user_index_repo.update_user_index(user_index)
+        _user_index_cache.invalidate((user_id, type))
+        return result
 
     def delete_user_index(self, user_id: str, type: str) -> Dict[str, Any]:
-        return self.user_index_repo.delete_user_index(user_id, type)
+        result = self.user_index_repo.delete_user_index(user_id, type)
+        _user_index_cache.invalidate((user_id, type))
+        return result
 
     def list_user_indices(self, user_id: str) -> Dict[str, Any]:
         return self.user_index_repo.list_user_indices(user_id)
+
+    @staticmethod
+    def cache_stats() -> Dict[str, Any]:
+        return _user_index_cache.stats()
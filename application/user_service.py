@@ -1,7 +1,7 @@
 import requests
 from infrastructure.user_repository import UserRepository
 from domain.user import User
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 import json
 from config.firebase import db, firebase_api_key
 
@@ -10,16 +10,11 @@ class UserService:
         self.user_repo = UserRepository()
 
     def create_or_update_user(self, user: User, password: str) -> Dict[str, Any]:
-        existing_user_response = self.user_repo.read_user_by_email(user.email)
-        print("----------- existing_user_response -----------")
-        print(existing_user_response)
-        if existing_user_response['status'] == 'success':
-            # User exists, update the user information
-            user.user_id = existing_user_response['user_id']
-            return self.user_repo.update_user(user)
-        else:
-            # User does not exist, create a new user
-            return self.user_repo.create_user(user, password)
+        # 既存のユーザーかどうかは email → UID の索引で判定する
+        return self.user_repo.create_or_update_user(user, password)
+
+    def upsert_users(self, users: List[Tuple[User, str]]) -> List[Dict[str, Any]]:
+        return self.user_repo.upsert_users(users)
 
     def login_user(self, email: str, password: str) -> Dict[str, Any]:
         try:
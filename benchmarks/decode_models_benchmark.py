@@ -0,0 +1,56 @@
+# benchmarks/decode_models_benchmark.py
+"""
+Firestoreから読み込んだ辞書を Insight / Billing に変換する方法ごとの所要時間を比較します。
+
+    python -m benchmarks.decode_models_benchmark [件数]
+"""
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+from domain.billing import Billing
+from domain.insight import Insight
+from domain.model_decoding import decode_models
+
+DEFAULT_RECORDS = 100000
+
+
+def make_insight_records(n):
+    posted_at = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [{
+        'post_id': str(i), 'user_id': f'user{i % 1000}',
+        'created_at': posted_at, 'posted_at': posted_at + timedelta(hours=i),
+        'post_url': f'https://www.instagram.com/p/{i}/', 'plot': 'plot',
+        'followers_reach_count': i % 300, 'like_count': i % 50, 'new_reach_count': i % 700,
+        'reach_count': i % 1000, 'save_count': i % 20,
+    } for i in range(n)]
+
+
+def make_billing_records(n):
+    payment_date = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [{
+        'billing_id': f'billing{i}', 'user_id': f'user{i}', 'plan': 'feed', 'status': 'active',
+        'payment_date': payment_date, 'cancellation_date': None,
+    } for i in range(n)]
+
+
+def measure(label, decode, records):
+    # 変換元の辞書を書き換える方法があっても結果が変わらないよう、毎回コピーを渡す
+    records = [dict(record) for record in records]
+    start = time.perf_counter()
+    decode(records)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<40} {elapsed:8.3f}s  {len(records) / elapsed:12,.0f} records/s")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_RECORDS
+    for model, records in [(Insight, make_insight_records(n)), (Billing, make_billing_records(n))]:
+        print(f"{model.__name__}: {n:,} records")
+        measure('per-object validation (current)', lambda rs: [model(**r) for r in rs], records)
+        measure('TypeAdapter(List[model]) validation', lambda rs: decode_models(model, rs, validate=True), records)
+        measure('model_construct', lambda rs: [model.model_construct(**r) for r in rs], records)
+        measure('decode_models (trusted)', lambda rs: decode_models(model, rs), records)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,8 +26,13 @@ class Insight(BaseModel):
 
     @classmethod
     def from_dict(cls, data: dict):
+        return cls(**cls.normalize_timestamps(data))
+
+    @staticmethod
+    def normalize_timestamps(data: dict) -> dict:
+        # 古いドキュメントは日時をUNIX時間の数値で持っている
         if 'created_at' in data and isinstance(data['created_at'], (int, float)):
             data['created_at'] = datetime.fromtimestamp(data['created_at'])
         if 'posted_at' in data and isinstance(data['posted_at'], (int, float)):
             data['posted_at'] = datetime.fromtimestamp(data['posted_at'])
-        return cls(**data)
+        return data
@@ -0,0 +1,64 @@
+# domain/model_decoding.py
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Tuple, Type, TypeVar
+from pydantic import BaseModel, TypeAdapter
+
+ModelT = TypeVar('ModelT', bound=BaseModel)
+
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    # TypeAdapter の作成はスキーマの構築を伴うため、モデルごとに1回だけ行う
+    return TypeAdapter(List[model])
+
+
+@lru_cache(maxsize=None)
+def _optional_fields(model: Type[BaseModel]) -> Tuple[Tuple[str, Any], ...]:
+    return tuple((name, field) for name, field in model.model_fields.items() if not field.is_required())
+
+
+def _construct(model: Type[ModelT], record: Dict[str, Any], field_names, optional_fields) -> ModelT:
+    # model_construct と同じ状態のインスタンスを、フィールドごとの処理を省いて作成する
+    values = {name: record[name] for name in field_names if name in record}
+    fields_set = set(values)
+    for name, field in optional_fields:
+        if name not in values:
+            values[name] = field.get_default(call_default_factory=True)
+    instance = model.__new__(model)
+    object.__setattr__(instance, '__dict__', values)
+    object.__setattr__(instance, '__pydantic_fields_set__', fields_set)
+    object.__setattr__(instance, '__pydantic_extra__', None)
+    object.__setattr__(instance, '__pydantic_private__', None)
+    return instance
+
+
+def decode_models(model: Type[ModelT], records: Iterable[Dict[str, Any]], validate: bool = False) -> List[ModelT]:
+    """
+    Firestoreなど、モデルを通して書き込んだ保存先から読み込んだ辞書を、まとめてモデルに変換します。
+
+    デフォルトでは保存済みのデータを信頼し、バリデーションを行わずに model_construct と同じ状態のインスタンスを作成します。
+    モデルにないキーは無視し、ないフィールドにはデフォルト値を設定します。
+    validate=True の場合は TypeAdapter(List[model]) で一括してバリデーションします。
+
+    Args:
+        model (Type[ModelT]): 変換先のモデル。
+        records (Iterable[Dict[str, Any]]): モデルのフィールドを持つ辞書。
+        validate (bool, optional): Trueの場合、すべてのバリデーションを実行します。
+
+    Returns:
+        List[ModelT]: 入力順のモデルのリスト。
+    """
+    if validate:
+        return _list_adapter(model).validate_python(list(records))
+    field_names = tuple(model.model_fields)
+    optional_fields = _optional_fields(model)
+    return [_construct(model, record, field_names, optional_fields) for record in records]
+
+
+def decode_model(model: Type[ModelT], record: Dict[str, Any], validate: bool = False) -> ModelT:
+    """
+    decode_models の1件版です。
+    """
+    if validate:
+        return model.model_validate(record)
+    return _construct(model, record, tuple(model.model_fields), _optional_fields(model))
@@ -2,6 +2,15 @@
 from typing import Optional
 from pydantic import BaseModel, Field
 
+# performanceドキュメントのフィールド名とダッシュボードでの表示名
+RUN_TYPE_LABELS = {
+    'feed_run': 'Feed Run',
+    'reel_run': 'Reel Run',
+    'feed_theme_run': 'Feed Theme Run',
+    'reel_theme_run': 'Reel Theme Run',
+    'data_analysis_run': 'Data Analysis Run',
+}
+
 class Performance(BaseModel):
     feed_run: Optional[int] = Field(0, ge=0)
     reel_run: Optional[int] = Field(0, ge=0)
@@ -1,12 +1,15 @@
 # infrastructure/billing_repository.py
 from firebase_admin import firestore
 from domain.billing import Billing
-from typing import Dict, Any
+from typing import Dict, Any, Optional
+from datetime import datetime, timezone
 from config.firebase import db  # FirebaseのFirestoreインスタンスをインポート
+from infrastructure.columnar import BILLING_SCHEMA, to_record_batch, to_table
 
 
 class BillingRepository:
     SUBCOLLECTION_NAME = 'billing'
+    CURRENT_BILLING_FIELD = 'current_billing'  # users/{uid} に非正規化して持つ最新のbillingの要約
 
     def create_or_update_billing(self, billing: Billing) -> Dict[str, Any]:
         try:
@@ -47,10 +50,97 @@ class BillingRepository:
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
-    def list_billing(self, user_id: str) -> Dict[str, Any]:
+    def list_billing(self, user_id: str, columnar: bool = False) -> Dict[str, Any]:
+        """
+        columnar=True の場合、billing_list の代わりに BILLING_SCHEMA の列を持つArrowのTableを billing_table として返します。
+        """
         try:
             billing_docs = db.collection('users').document(user_id).collection(self.SUBCOLLECTION_NAME).stream()
             billing_list = [{'billing_id': doc.id, **doc.to_dict()} for doc in billing_docs]
+            if columnar:
+                return {'status': 'success', 'billing_table': to_table([to_record_batch(billing_list, BILLING_SCHEMA)], BILLING_SCHEMA)}
             return {'status': 'success', 'billing_list': billing_list}
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
+
+    def list_all_billing(self) -> Dict[str, Any]:
+        """
+        全ユーザーの billing を1本のコレクショングループクエリで取得します。user_id はドキュメントのパスから取得します。
+        """
+        try:
+            billing_docs = db.collection_group(self.SUBCOLLECTION_NAME).stream()
+            billing_list = [
+                {**doc.to_dict(), 'billing_id': doc.id, 'user_id': doc.reference.parent.parent.id}
+                for doc in billing_docs
+            ]
+            return {'status': 'success', 'billing_list': billing_list}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def set_current_billing(self, user_id: str, current_billing: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        ユーザードキュメントの current_billing を無条件に書き換えます。Noneの場合はbillingなしとして記録します。
+        """
+        try:
+            db.collection('users').document(user_id).update({self.CURRENT_BILLING_FIELD: current_billing})
+            return {'status': 'success'}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def backfill_current_billing(self, current_billing_by_user: Dict[str, Dict[str, Any]], batch_size: int = 500) -> Dict[str, Any]:
+        """
+        全ユーザーの current_billing を current_billing_by_user の値で書き換えます。含まれないユーザーはbillingなし(None)として記録します。
+        ユーザーはIDだけを読み込み、書き込みは batch_size 件ずつのバッチで行います。
+        """
+        try:
+            updated = 0
+            pending = 0
+            batch = db.batch()
+            for user_doc in db.collection('users').select([]).stream():
+                batch.update(user_doc.reference, {self.CURRENT_BILLING_FIELD: current_billing_by_user.get(user_doc.id)})
+                pending += 1
+                if pending >= batch_size:
+                    batch.commit()
+                    updated += pending
+                    pending = 0
+                    batch = db.batch()
+            if pending:
+                batch.commit()
+                updated += pending
+            return {'status': 'success', 'updated': updated}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def set_current_billing_if_latest(self, user_id: str, current_billing: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        current_billing が同じbillingを指している場合、または payment_date が既存以上の場合にだけ書き換えます。
+        読み取りと書き込みはトランザクション内で行います。
+        """
+        try:
+            user_ref = db.collection('users').document(user_id)
+
+            @firestore.transactional
+            def update_in_transaction(transaction) -> bool:
+                user_doc = user_ref.get(transaction=transaction)
+                if not user_doc.exists:
+                    return False
+                existing = (user_doc.to_dict() or {}).get(self.CURRENT_BILLING_FIELD)
+                if existing and existing.get('billing_id') != current_billing['billing_id']:
+                    if self._payment_date_key(existing) > self._payment_date_key(current_billing):
+                        return False
+                transaction.update(user_ref, {self.CURRENT_BILLING_FIELD: current_billing})
+                return True
+
+            updated = update_in_transaction(db.transaction())
+            return {'status': 'success', 'updated': updated}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    @staticmethod
+    def _payment_date_key(billing: Dict[str, Any]) -> datetime:
+        payment_date = billing.get('payment_date')
+        if payment_date is None:
+            return datetime.min.replace(tzinfo=timezone.utc)
+        if payment_date.tzinfo is None:
+            return payment_date.replace(tzinfo=timezone.utc)
+        return payment_date
@@ -0,0 +1,55 @@
+# infrastructure/columnar.py
+import pyarrow as pa
+from typing import Any, Dict, Iterable, List
+
+# Firestoreのドキュメントを列指向で返す場合のスキーマ。スキーマにないフィールドは読み捨て、ないフィールドはnullになる
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+
+INSIGHT_SCHEMA = pa.schema([
+    ('user_id', pa.string()),
+    ('post_id', pa.string()),
+    ('created_at', TIMESTAMP),
+    ('posted_at', TIMESTAMP),
+    ('post_url', pa.string()),
+    ('plot', pa.string()),
+    ('followers_reach_count', pa.int64()),
+    ('like_count', pa.int64()),
+    ('new_reach_count', pa.int64()),
+    ('reach_count', pa.int64()),
+    ('save_count', pa.int64()),
+])
+
+BILLING_SCHEMA = pa.schema([
+    ('billing_id', pa.string()),
+    ('user_id', pa.string()),
+    ('plan', pa.string()),
+    ('status', pa.string()),
+    ('payment_date', TIMESTAMP),
+    ('cancellation_date', TIMESTAMP),
+])
+
+PROMPT_SCHEMA = pa.schema([
+    ('prompt_id', pa.string()),
+    ('user_id', pa.string()),
+    ('type', pa.string()),
+    ('text', pa.string()),
+    ('example_plot', pa.string()),
+])
+
+
+def to_record_batch(records: List[Dict[str, Any]], schema: pa.Schema) -> pa.RecordBatch:
+    """
+    辞書のリストを、schema の列を持つArrowのRecordBatchに変換します。
+
+    ページ単位で変換して元の辞書を手放すことで、全件を辞書のまま保持する場合よりピークメモリを抑えられます。
+    schema で選んだフィールドだけが含まれるため、select() で絞り込んだ結果も変換できます。
+    """
+    return pa.RecordBatch.from_pylist(records, schema=schema)
+
+
+def to_table(batches: Iterable[pa.RecordBatch], schema: pa.Schema) -> pa.Table:
+    """
+    RecordBatchをつなげてTableにします。データのコピーは行いません。
+    pandasで扱う場合は table.to_pandas() を呼び出します。
+    """
+    return pa.Table.from_batches(list(batches), schema=schema)
@@ -0,0 +1,81 @@
+# infrastructure/email_index.py
+import threading
+import time
+from typing import Dict, Optional
+from config.firebase import db
+
+DEFAULT_EMAIL_INDEX_TTL_SECONDS = 600
+
+
+class EmailIndex:
+    """
+    users コレクションの email → UID の対応をプロセス内に保持します。
+
+    初回の参照時に users を email だけに絞った1本のストリームで読み込み、ttl_seconds を過ぎると次の参照時に読み込み直します。
+    UserRepository の作成・更新・削除は set / remove で同期的に反映するため、このプロセスからの変更は直ちに見えます。
+    他のプロセスからの変更は、最大 ttl_seconds 遅れて反映されます。
+    """
+    def __init__(self, ttl_seconds: float = DEFAULT_EMAIL_INDEX_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self._uid_by_email: Dict[str, str] = {}
+        self._email_by_uid: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.RLock()
+
+    def get(self, email: str) -> Optional[str]:
+        """
+        email のユーザーのUIDを返します。存在しない場合はNoneです。
+        """
+        with self._lock:
+            self._ensure_fresh()
+            return self._uid_by_email.get(email)
+
+    def set(self, email: str, user_id: str) -> None:
+        with self._lock:
+            # メールアドレスが変わった場合は古い対応を消す
+            self._remove_user(user_id)
+            self._uid_by_email[email] = user_id
+            self._email_by_uid[user_id] = email
+
+    def remove(self, user_id: str) -> None:
+        with self._lock:
+            self._remove_user(user_id)
+
+    def invalidate(self) -> None:
+        """
+        次の参照時に users を読み込み直すようにします。
+        """
+        with self._lock:
+            self._loaded_at = None
+
+    def _ensure_fresh(self) -> None:
+        if self._loaded_at is not None and time.time() - self._loaded_at < self.ttl_seconds:
+            return
+        uid_by_email = {}
+        for doc in db.collection('users').select(['email']).stream():
+            email = (doc.to_dict() or {}).get('email')
+            if email:
+                uid_by_email[email] = doc.id
+        self._uid_by_email = uid_by_email
+        self._email_by_uid = {user_id: email for email, user_id in uid_by_email.items()}
+        self._loaded_at = time.time()
+
+    def _remove_user(self, user_id: str) -> None:
+        email = self._email_by_uid.pop(user_id, None)
+        if email is not None and self._uid_by_email.get(email) == user_id:
+            del self._uid_by_email[email]
+
+
+_email_index = None
+_email_index_lock = threading.Lock()
+
+
+def get_email_index() -> EmailIndex:
+    """
+    プロセスに1つの EmailIndex を返します。初回の呼び出しで作成します。
+    """
+    global _email_index
+    with _email_index_lock:
+        if _email_index is None:
+            _email_index = EmailIndex()
+        return _email_index
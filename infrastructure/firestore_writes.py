@@ -0,0 +1,55 @@
+# infrastructure/firestore_writes.py
+from firebase_admin import firestore
+from google.api_core.exceptions import NotFound
+from typing import Any, Dict
+from config.firebase import db
+
+NOT_FOUND_MESSAGE = 'Document not found'
+
+
+def not_found_response() -> Dict[str, Any]:
+    return {'status': 'error', 'message': NOT_FOUND_MESSAGE}
+
+
+def update_existing(doc_ref, data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    ドキュメントが存在する場合だけ更新します。
+
+    update はドキュメントの存在を前提条件とする書き込みなので、事前の読み込みなしに1回の往復で済みます。
+    ドキュメントが存在しない場合は 'Document not found' のエラーレスポンスを返します。
+    """
+    try:
+        doc_ref.update(data)
+        return {'status': 'success'}
+    except NotFound:
+        return not_found_response()
+
+
+def delete_existing(doc_ref) -> Dict[str, Any]:
+    """
+    ドキュメントが存在する場合だけ削除します。exists=True の前提条件付きで削除するため、事前の読み込みは不要です。
+    ドキュメントが存在しない場合は 'Document not found' のエラーレスポンスを返します。
+    """
+    try:
+        doc_ref.delete(option=db.write_option(exists=True))
+        return {'status': 'success'}
+    except NotFound:
+        return not_found_response()
+
+
+def increment_merge(writer, doc_ref, counts: Dict[str, int], fields: Dict[str, Any] = None) -> None:
+    """
+    counts の各フィールドを Increment で加算し、fields をそのまま書き込む merge 書き込みを writer に追加します。
+    ドキュメントが存在しなければ作成されるため、存在確認の読み込みは不要です。
+
+    Args:
+        writer: WriteBatch または Transaction。Noneの場合はその場で書き込みます。
+        doc_ref: 書き込み先のドキュメント参照。
+        counts (Dict[str, int]): フィールド名と加算する値。
+        fields (Dict[str, Any], optional): 加算せずに上書きするフィールド。
+    """
+    data = {**{field: firestore.Increment(count) for field, count in counts.items()}, **(fields or {})}
+    if writer is None:
+        doc_ref.set(data, merge=True)
+    else:
+        writer.set(doc_ref, data, merge=True)
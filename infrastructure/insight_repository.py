@@ -2,31 +2,261 @@
 
 from firebase_admin import firestore
 from domain.insight import Insight
-from typing import List, Dict, Any
+from domain.model_decoding import decode_models
+from infrastructure.columnar import INSIGHT_SCHEMA, to_record_batch, to_table
+from typing import List, Dict, Any, Iterator, Optional, Union
+from concurrent.futures import ThreadPoolExecutor
 from config.firebase import db
+from datetime import datetime, timezone
+from utils.concurrency import DEFAULT_MAX_WORKERS
 import logging
+import pyarrow as pa
+import queue
+import threading
 
 class InsightRepository:
+    COLLECTION_NAME = 'insight_data'
+    DEFAULT_PAGE_SIZE = 500
+    DEFAULT_PARTITION_COUNT = 8
+    DEFAULT_BATCH_SIZE = 500
+
     def __init__(self):
         self.db = db
 
-    def get_insights_by_user(self, user_id: str) -> List[Insight]:
-        insights = []
-        user_ref = self.db.collection('users').document(user_id)
-        insight_collection = user_ref.collection('insight_data')
-
+    def get_insights_by_user(self, user_id: str, columnar: bool = False) -> Union[List[Insight], pa.Table]:
+        """
+        columnar=True の場合、Insight のリストの代わりに INSIGHT_SCHEMA の列を持つArrowのTableを返します。
+        ページごとに列指向に変換するため、全件を辞書やモデルとして同時に保持しません。
+        """
         logging.info(f"Fetching insights for user: {user_id}")
+        if columnar:
+            insight_collection = self.db.collection('users').document(user_id).collection(self.COLLECTION_NAME)
+            query = insight_collection.order_by(firestore.FieldPath.document_id())
+            insights = to_table(
+                (self._to_record_batch([self._to_record(doc, user_id) for doc in docs])
+                 for docs in self._iter_pages(query, self.DEFAULT_PAGE_SIZE)),
+                INSIGHT_SCHEMA
+            )
+            logging.info(f"Total insights found: {insights.num_rows}")
+            return insights
+        insights = list(self.stream_insights_by_user(user_id))
+        logging.info(f"Total insights found: {len(insights)}")
+        return insights
 
-        for doc in insight_collection.stream():
-            logging.info(f"Found document: {doc.id}")
-            insight_data = doc.to_dict()
-            insight_data['post_id'] = doc.id
-            insight_data['user_id'] = user_id
-            insights.append(Insight.from_dict(insight_data))
+    def stream_insights_by_user(self,
+                                user_id: str,
+                                page_size: int = DEFAULT_PAGE_SIZE,
+                                start_after: Optional[str] = None,
+                                fields: Optional[List[str]] = None,
+                                posted_from: Optional[datetime] = None,
+                                posted_to: Optional[datetime] = None,
+                                validate: bool = False) -> Iterator[Union[Insight, Dict[str, Any]]]:
+        """
+        ユーザーのインサイトを page_size 件ずつ読み込みながら1件ずつ返します。
 
-        logging.info(f"Total insights found: {len(insights)}")
+        Args:
+            user_id (str): ユーザーID。
+            page_size (int, optional): 1回のクエリで読み込む件数。
+            start_after (str, optional): このpost_idのインサイトの次から返します。前回の最後の post_id を渡すと続きを取得できます。
+            fields (List[str], optional): 指定した場合、そのフィールドだけを読み込み、Insight に変換せず辞書で返します。
+                辞書には常に post_id と user_id が含まれます。
+            posted_from (datetime, optional): posted_at がこの日時以降のインサイトに絞り込みます。
+            posted_to (datetime, optional): posted_at がこの日時より前のインサイトに絞り込みます。
+                Firestore の範囲条件は同じ型の値にしか一致しないため、posted_at をUNIX時間の数値で持つ古いドキュメントは
+                posted_from / posted_to を指定すると返りません。backfill_posted_at_timestamps で日時に変換しておく必要があります。
+            validate (bool, optional): Trueの場合、Insight への変換時にバリデーションを実行します。
+                デフォルトでは保存済みのデータを信頼し、バリデーションせずに作成します。
+
+        Yields:
+            Union[Insight, Dict[str, Any]]: fields を指定しない場合は Insight、指定した場合は辞書。
+                posted_at で絞り込む場合は posted_at 順、それ以外は post_id 順です。
+        """
+        insight_collection = self.db.collection('users').document(user_id).collection(self.COLLECTION_NAME)
+        query = insight_collection
+        # posted_at を持たないドキュメントも返せるよう、期間を指定しない場合は post_id 順にする
+        filter_by_posted_at = posted_from is not None or posted_to is not None
+        if filter_by_posted_at:
+            if posted_from is not None:
+                query = query.where('posted_at', '>=', posted_from)
+            if posted_to is not None:
+                query = query.where('posted_at', '<', posted_to)
+            query = query.order_by('posted_at')
+        query = query.order_by(firestore.FieldPath.document_id())
+        # ページの続きはカーソルに並び順のフィールドが必要なため、posted_at で絞り込む場合は常に読み込む
+        drop_posted_at = fields is not None and filter_by_posted_at and 'posted_at' not in fields
+        if fields is not None:
+            query = query.select(list(fields) + ['posted_at'] if drop_posted_at else fields)
+
+        cursor = None
+        if start_after is not None:
+            cursor = insight_collection.document(start_after).get()
+            if not cursor.exists:
+                raise ValueError(f"Insight not found: {start_after}")
+
+        for docs in self._iter_pages(query, page_size, cursor):
+            records = [self._to_record(doc, user_id) for doc in docs]
+            if drop_posted_at:
+                for record in records:
+                    record.pop('posted_at', None)
+            yield from records if fields is not None else self._decode(records, validate)
+
+    def backfill_posted_at_timestamps(self, batch_size: int = DEFAULT_BATCH_SIZE) -> Dict[str, Any]:
+        """
+        posted_at をUNIX時間の数値で持つ既存の insight_data ドキュメントを、UTCの日時に書き換えます。
+        """
+        try:
+            updated = 0
+            pending = 0
+            batch = self.db.batch()
+            for doc in self.db.collection_group(self.COLLECTION_NAME).select(['posted_at']).stream():
+                posted_at = (doc.to_dict() or {}).get('posted_at')
+                if not isinstance(posted_at, (int, float)) or isinstance(posted_at, bool):
+                    continue
+                batch.update(doc.reference, {'posted_at': datetime.fromtimestamp(posted_at, tz=timezone.utc)})
+                pending += 1
+                if pending >= batch_size:
+                    batch.commit()
+                    updated += pending
+                    pending = 0
+                    batch = self.db.batch()
+            if pending:
+                batch.commit()
+                updated += pending
+            return {'status': 'success', 'updated': updated}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def get_all_insights(self, validate: bool = False) -> List[Insight]:
+        insights = [insight for batch in self.stream_all_insights(validate=validate) for insight in batch]
+        logging.info(f"Total insights found across all users: {len(insights)}")
         return insights
 
+    def stream_all_insights(self,
+                            partition_count: int = DEFAULT_PARTITION_COUNT,
+                            batch_size: int = DEFAULT_BATCH_SIZE,
+                            fields: Optional[List[str]] = None,
+                            max_workers: int = DEFAULT_MAX_WORKERS,
+                            validate: bool = False,
+                            columnar: bool = False) -> Iterator[Union[List[Union[Insight, Dict[str, Any]]], pa.RecordBatch]]:
+        """
+        全ユーザーのインサイトを insight_data のコレクショングループクエリで読み込み、batch_size 件ごとのリストで返します。
+
+        クエリは get_partitions で最大 partition_count 個の範囲に分割し、範囲ごとに並列に読み込みます。
+        バッチはでき上がった順に返すため、ユーザーや post_id の順序は保証されません。
+        読み込み中のバッチは上限付きのキューに溜めるので、呼び出し側の処理が遅くてもメモリ使用量は一定に保たれます。
+
+        Args:
+            partition_count (int, optional): クエリを分割する最大数。1の場合は分割せずに1本のクエリで読み込みます。
+            batch_size (int, optional): 1回に返す件数。
+            fields (List[str], optional): 指定した場合、そのフィールドだけを読み込み、Insight に変換せず辞書で返します。
+            max_workers (int, optional): 並列に読み込む範囲の数。
+            validate (bool, optional): Trueの場合、Insight への変換時にバリデーションを実行します。
+            columnar (bool, optional): Trueの場合、バッチを INSIGHT_SCHEMA の列(fields を指定した場合はその列)を持つ
+                ArrowのRecordBatchとして返します。pa.Table.from_batches でコピーせずにつなげられます。
+
+        Yields:
+            Union[List[Union[Insight, Dict[str, Any]]], pa.RecordBatch]: インサイトのバッチ。
+        """
+        collection_group = self.db.collection_group(self.COLLECTION_NAME)
+        queries = [partition.query() for partition in collection_group.get_partitions(partition_count)] if partition_count > 1 else []
+        queries = queries or [collection_group]
+        if fields is not None:
+            queries = [query.select(fields) for query in queries]
+
+        batches = queue.Queue(maxsize=max(1, int(max_workers)) * 2)
+        stopped = threading.Event()
+        done = object()
+
+        def put(item) -> bool:
+            # 呼び出し側がイテレーションを止めた場合は、キューが空くのを待たずに終了する
+            while not stopped.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def decode(batch):
+            if columnar:
+                return self._to_record_batch(batch, fields)
+            return batch if fields is not None else self._decode(batch, validate)
+
+        def read_partition(query) -> None:
+            try:
+                batch = []
+                for doc in query.stream():
+                    # users/{uid}/insight_data/{post_id} のパスからUIDを取り出す
+                    batch.append(self._to_record(doc, doc.reference.parent.parent.id))
+                    if len(batch) >= batch_size:
+                        if not put(decode(batch)):
+                            return
+                        batch = []
+                if batch:
+                    put(decode(batch))
+            except Exception as e:
+                put(e)
+            finally:
+                put(done)
+
+        with ThreadPoolExecutor(max_workers=max(1, min(int(max_workers), len(queries)))) as executor:
+            for query in queries:
+                executor.submit(read_partition, query)
+            try:
+                remaining = len(queries)
+                while remaining:
+                    item = batches.get()
+                    if item is done:
+                        remaining -= 1
+                    elif isinstance(item, Exception):
+                        raise item
+                    else:
+                        yield item
+            finally:
+                stopped.set()
+
+    @staticmethod
+    def _iter_pages(query, page_size: int, last_doc=None):
+        while True:
+            page = query.limit(page_size)
+            if last_doc:
+                page = page.start_after(last_doc)
+            docs = list(page.stream())
+            if docs:
+                yield docs
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    @staticmethod
+    def _to_record(doc, user_id: str) -> Dict[str, Any]:
+        insight_data = doc.to_dict() or {}
+        insight_data['post_id'] = doc.id
+        insight_data['user_id'] = user_id
+        return insight_data
+
+    @staticmethod
+    def _to_record_batch(records: List[Dict[str, Any]], fields: Optional[List[str]] = None) -> pa.RecordBatch:
+        schema = INSIGHT_SCHEMA
+        if fields is not None:
+            names = ['user_id', 'post_id'] + [name for name in fields if name in INSIGHT_SCHEMA.names]
+            schema = pa.schema([INSIGHT_SCHEMA.field(name) for name in dict.fromkeys(names)])
+        return to_record_batch([InsightRepository._to_utc_timestamps(record) for record in records], schema)
+
+    @staticmethod
+    def _to_utc_timestamps(record: Dict[str, Any]) -> Dict[str, Any]:
+        # 古いドキュメントのUNIX時間は、UTCの列にそのまま入るよう aware なUTCの日時にする
+        # (Insight.normalize_timestamps はローカル時刻の naive な日時を返すため、UTC以外のホストでずれる)
+        for field in ('created_at', 'posted_at'):
+            value = record.get(field)
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                record[field] = datetime.fromtimestamp(value, tz=timezone.utc)
+        return record
+
+    @staticmethod
+    def _decode(records: List[Dict[str, Any]], validate: bool) -> List[Insight]:
+        return decode_models(Insight, [Insight.normalize_timestamps(record) for record in records], validate=validate)
+
     def create_insight(self, insight: Insight) -> Dict[str, Any]:
         user_ref = self.db.collection('users').document(insight.user_id)
         insight_ref = user_ref.collection('insight_data').document(insight.post_id)
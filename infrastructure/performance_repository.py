@@ -1,41 +1,219 @@
 from firebase_admin import firestore
-from typing import Dict, Any
+from collections import defaultdict
+from typing import Dict, Any, Iterator, Tuple
 from config.firebase import db
 from datetime import datetime
+from infrastructure.firestore_writes import increment_merge
+from infrastructure.rollup_repository import RollupRepository
+from infrastructure.sharded_counter import SHARD_RANGE_END, base_id, iter_merged_shards, shard_id, sum_shards
 
 class PerformanceRepository:
-    def __init__(self, user_id: str):
+    COLLECTION_NAME = 'performance'
+    DEFAULT_PAGE_SIZE = 1000
+
+    def __init__(self, user_id: str, num_shards: int = 1):
+        """
+        num_shards が2以上の場合、ラン数は日ごとに num_shards 個のシャードドキュメント
+        ('YYYY-MM-DD_{シャード番号}') にランダムに分散して加算します。読み込み側は常にシャードを合計して返すため、
+        同時に大量のランを記録するユーザーだけシャード数を増やすことができます。
+        """
         self.user_id = user_id
-        self.collection_ref = db.collection('users').document(user_id).collection('performance')
+        self.num_shards = num_shards
+        self.collection_ref = db.collection('users').document(user_id).collection(self.COLLECTION_NAME)
+        self.rollup_repo = RollupRepository()
 
     def log_run(self, run_type: str, date: datetime.date, count: int = 1) -> Dict[str, Any]:
         date_str = date.strftime('%Y-%m-%d')
-        doc_ref = self.collection_ref.document(date_str)
-        doc = doc_ref.get()
 
-        if doc.exists:
-            doc_ref.update({run_type: firestore.Increment(count)})
-        else:
-            doc_ref.set({run_type: count})
+        # 日次ドキュメントとロールアップを同じバッチで更新する
+        batch = db.batch()
+        # 'date' はコレクショングループクエリで期間を絞り込むためのフィールド
+        doc_ref = self.collection_ref.document(shard_id(date_str, self.num_shards))
+        increment_merge(batch, doc_ref, {run_type: count}, {'date': date_str})
+        self.rollup_repo.add_run(batch, self.user_id, run_type, date, count, num_shards=self.num_shards)
+        batch.commit()
 
         return {'status': 'success', 'date': date_str}
 
+    @classmethod
+    def write_run_increments(cls, increments: Dict[Tuple[str, str, str], int]) -> int:
+        """
+        (UID, 'YYYY-MM-DD', ラン種別) ごとに集約済みのラン数を、1つのバッチでまとめて加算します。
+
+        performance ドキュメントは (UID, 日付) ごと、日次ロールアップは日付ごと、月次ロールアップは (UID, 月) ごとに
+        1回の merge 書き込みにまとめるため、存在確認の読み取りは行いません。
+        1バッチの書き込み上限(500件)を超えないよう、呼び出し側で (UID, 日付) の組の数を抑えてください。
+
+        Returns:
+            int: コミットした書き込みの件数。
+        """
+        performance_counts = defaultdict(lambda: defaultdict(int))
+        daily_counts = defaultdict(lambda: defaultdict(int))
+        monthly_counts = defaultdict(lambda: defaultdict(int))
+        for (user_id, date_str, run_type), count in increments.items():
+            performance_counts[(user_id, date_str)][run_type] += count
+            daily_counts[date_str][run_type] += count
+            monthly_counts[(user_id, date_str[:7])][run_type] += count
+
+        rollup_repo = RollupRepository()
+        batch = db.batch()
+        for (user_id, date_str), counts in performance_counts.items():
+            doc_ref = db.collection('users').document(user_id).collection(cls.COLLECTION_NAME).document(date_str)
+            increment_merge(batch, doc_ref, counts, {'date': date_str})
+        for date_str, counts in daily_counts.items():
+            rollup_repo.add_daily_runs(batch, date_str, counts)
+        for (user_id, month_str), counts in monthly_counts.items():
+            rollup_repo.add_monthly_runs(batch, user_id, month_str, counts)
+        batch.commit()
+        return len(performance_counts) + len(daily_counts) + len(monthly_counts)
+
     def get_run_count(self, run_type: str, date: datetime.date) -> Dict[str, Any]:
         date_str = date.strftime('%Y-%m-%d')
-        doc_ref = self.collection_ref.document(date_str)
-        doc = doc_ref.get()
+        performance_data = self._read_day(date_str)
 
-        if doc.exists and run_type in doc.to_dict():
-            return {'status': 'success', 'date': date_str, 'count': doc.to_dict()[run_type]}
+        if performance_data is not None and run_type in performance_data:
+            return {'status': 'success', 'date': date_str, 'count': performance_data[run_type]}
         else:
             return {'status': 'error', 'message': 'No data found for the specified date and run type'}
 
     def list_all_runs(self, date: datetime.date) -> Dict[str, Any]:
         date_str = date.strftime('%Y-%m-%d')
-        doc_ref = self.collection_ref.document(date_str)
-        doc = doc_ref.get()
+        performance_data = self._read_day(date_str)
 
-        if doc.exists:
-            return {'status': 'success', 'data': doc.to_dict()}
+        if performance_data is not None:
+            return {'status': 'success', 'data': performance_data}
         else:
             return {'status': 'error', 'message': 'No data found for the specified date'}
+
+    def _read_day(self, date_str: str):
+        # 日次ドキュメントとそのシャードを合計する。どちらも存在しない場合はNone
+        return self._read_days(date_str, date_str).get(date_str)
+
+    def _read_days(self, start_str: str, end_str: str) -> Dict[str, Dict[str, Any]]:
+        document_id = firestore.FieldPath.document_id()
+        docs = (
+            self.collection_ref
+            .where(document_id, '>=', self.collection_ref.document(start_str))
+            .where(document_id, '<=', self.collection_ref.document(end_str + SHARD_RANGE_END))
+            .order_by(document_id)
+            .stream()
+        )
+        return sum_shards(docs)
+
+    def list_runs_between(self, start_date: datetime.date, end_date: datetime.date) -> Dict[str, Any]:
+        """
+        start_dateからend_dateまで(両端を含む)のパフォーマンスドキュメントを取得します。
+
+        ドキュメントIDは 'YYYY-MM-DD' 形式のため、IDの範囲クエリで期間外のドキュメントを読み込まずに済みます。
+        シャードに分かれた日は合計して1件として返します。
+        """
+        start_str = start_date.strftime('%Y-%m-%d')
+        end_str = end_date.strftime('%Y-%m-%d')
+        try:
+            return {'status': 'success', 'data': self._read_days(start_str, end_str)}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    @classmethod
+    def stream_all_runs_between(cls, start_date: datetime.date, end_date: datetime.date, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """
+        全ユーザーの performance サブコレクションを1本のコレクショングループクエリで横断し、
+        期間内(両端を含む)のドキュメントを (UID, 日付, データ) としてページ単位で取得します。
+
+        'date' フィールドで絞り込むため、Firestore側で performance.date のコレクショングループ
+        インデックスを有効にし、'date' を持たない古いドキュメントは backfill_date_fields で補完しておく必要があります。
+        シャードに分かれた日は合計して1件として返します。
+        """
+        start_str = start_date.strftime('%Y-%m-%d')
+        end_str = end_date.strftime('%Y-%m-%d')
+        query = (
+            db.collection_group(cls.COLLECTION_NAME)
+            .where('date', '>=', start_str)
+            .where('date', '<=', end_str)
+            .order_by('date')
+        )
+        # 同じ日付の中ではパス順に並ぶため、同じユーザーの同じ日のシャードは連続して返される
+        for parent_ref, date_str, performance_data in iter_merged_shards(cls._stream_pages(query, page_size)):
+            # users/{uid}/performance/{YYYY-MM-DD} のパスからUIDを取り出す
+            yield parent_ref.parent.id, date_str, performance_data
+
+    @classmethod
+    def stream_all_runs(cls, page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[Tuple[str, str, Dict[str, Any]]]:
+        """
+        全ユーザーの全期間の performance ドキュメントを (UID, 日付, データ) としてページ単位で取得します。
+        'date' フィールドを持たない古いドキュメントも含みます。ドキュメントIDが日付でないものは除外します。
+        シャードに分かれた日は合計して1件として返します。
+        """
+        query = db.collection_group(cls.COLLECTION_NAME).order_by(firestore.FieldPath.document_id())
+        for parent_ref, date_str, performance_data in iter_merged_shards(cls._stream_pages(query, page_size)):
+            try:
+                datetime.strptime(date_str, '%Y-%m-%d')
+            except ValueError:
+                continue
+            yield parent_ref.parent.id, date_str, performance_data
+
+    @classmethod
+    def backfill_rollups(cls, page_size: int = DEFAULT_PAGE_SIZE) -> Dict[str, Any]:
+        """
+        全期間の performance ドキュメントから日次・月次のロールアップを集計し直し、RollupRepository.rebuild で書き込みます。
+        ロールアップの導入前に記録されたランを合計に含めるためのもので、ランの記録が止まっている間に実行してください。
+        """
+        try:
+            daily_counts = defaultdict(lambda: defaultdict(int))
+            monthly_counts = defaultdict(lambda: defaultdict(int))
+            for user_id, date_str, performance_data in cls.stream_all_runs(page_size):
+                for run_type, count in performance_data.items():
+                    if not isinstance(count, (int, float)) or isinstance(count, bool):
+                        continue
+                    daily_counts[date_str][run_type] += count
+                    monthly_counts[(user_id, date_str[:7])][run_type] += count
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+        return RollupRepository().rebuild(
+            {date_str: dict(counts) for date_str, counts in daily_counts.items()},
+            {key: dict(counts) for key, counts in monthly_counts.items()}
+        )
+
+    @staticmethod
+    def _stream_pages(query, page_size: int):
+        last_doc = None
+        while True:
+            page = query.limit(page_size)
+            if last_doc:
+                page = page.start_after(last_doc)
+            docs = list(page.stream())
+            yield from docs
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    @classmethod
+    def backfill_date_fields(cls, batch_size: int = 500) -> Dict[str, Any]:
+        """
+        'date' フィールドを持たない既存の performance ドキュメントに、ドキュメントIDの日付を書き込みます。
+        """
+        try:
+            updated = 0
+            pending = 0
+            batch = db.batch()
+            for doc in db.collection_group(cls.COLLECTION_NAME).stream():
+                if 'date' in (doc.to_dict() or {}):
+                    continue
+                date_str = base_id(doc.id)
+                try:
+                    datetime.strptime(date_str, '%Y-%m-%d')
+                except ValueError:
+                    continue
+                batch.update(doc.reference, {'date': date_str})
+                pending += 1
+                if pending >= batch_size:
+                    batch.commit()
+                    updated += pending
+                    pending = 0
+                    batch = db.batch()
+            if pending:
+                batch.commit()
+                updated += pending
+            return {'status': 'success', 'updated': updated}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
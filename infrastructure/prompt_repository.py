@@ -2,6 +2,8 @@ from firebase_admin import firestore
 from domain.prompt import Prompt
 from typing import Dict, Any
 from config.firebase import db
+from infrastructure.columnar import PROMPT_SCHEMA, to_record_batch, to_table
+from infrastructure.firestore_writes import delete_existing, update_existing
 
 class PromptRepository:
     def create_prompt(self, prompt: Prompt) -> Dict[str, Any]:
@@ -19,22 +21,18 @@ class PromptRepository:
 
     def update_prompt(self, prompt: Prompt) -> Dict[str, Any]:
         doc_ref = db.collection('users').document(prompt.user_id).collection('prompts').document(prompt.type)
-        doc = doc_ref.get()
-        if doc.exists:
-            doc_ref.update(prompt.dict(exclude_unset=True))
-            return {'status': 'success'}
-        else:
-            return {'status': 'error', 'message': 'Document not found'}
+        return update_existing(doc_ref, prompt.dict(exclude_unset=True))
 
     def delete_prompt(self, user_id: str, type: str) -> Dict[str, Any]:
         doc_ref = db.collection('users').document(user_id).collection('prompts').document(type)
-        doc = doc_ref.get()
-        if doc.exists:
-            doc_ref.delete()
-            return {'status': 'success'}
-        else:
-            return {'status': 'error', 'message': 'Document not found'}
+        return delete_existing(doc_ref)
 
-    def list_prompts(self, user_id: str) -> Dict[str, Any]:
+    def list_prompts(self, user_id: str, columnar: bool = False) -> Dict[str, Any]:
+        """
+        columnar=True の場合、data は PROMPT_SCHEMA の列を持つArrowのTableになります。
+        """
         docs = db.collection('users').document(user_id).collection('prompts').stream()
-        return {'status': 'success', 'data': [{'prompt_id': doc.id, **doc.to_dict()} for doc in docs]}
+        prompts = [{'prompt_id': doc.id, **doc.to_dict()} for doc in docs]
+        if columnar:
+            return {'status': 'success', 'data': to_table([to_record_batch(prompts, PROMPT_SCHEMA)], PROMPT_SCHEMA)}
+        return {'status': 'success', 'data': prompts}
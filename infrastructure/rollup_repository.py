@@ -0,0 +1,149 @@
+# infrastructure/rollup_repository.py
+from firebase_admin import firestore
+from typing import Dict, Any, Tuple
+from config.firebase import db
+from datetime import datetime
+from infrastructure.firestore_writes import increment_merge
+from infrastructure.sharded_counter import SHARD_RANGE_END, merge_counts, shard_id, sum_shards
+
+
+class RollupRepository:
+    """
+    ラン数の集計済みドキュメント(ロールアップ)を管理します。
+
+    - usage_rollups_daily/{YYYY-MM-DD}: 全ユーザー合計の日次ラン数(ラン種別ごと)
+    - users/{uid}/usage_rollups_monthly/{YYYY-MM}: ユーザーごとの月次ラン数(ラン種別ごと)
+
+    日次ロールアップは全ユーザーのランが同じドキュメントに集中するため、常に DAILY_SHARD_COUNT 個の
+    シャード('YYYY-MM-DD_{シャード番号}')に分散して加算し、読み込み時に合計します。
+    """
+    DAILY_COLLECTION_NAME = 'usage_rollups_daily'
+    DAILY_SHARD_COUNT = 10
+    MONTHLY_SUBCOLLECTION_NAME = 'usage_rollups_monthly'
+
+    def add_run(self, batch, user_id: str, run_type: str, date: datetime.date, count: int = 1, num_shards: int = 1) -> None:
+        """
+        ラン数の加算をバッチに追加します。performance ドキュメントの更新と同じバッチでコミットすることで、
+        ロールアップと日次の生データが常に一致します。num_shards は月次ロールアップのシャード数です。
+        """
+        self.add_daily_runs(batch, date.strftime('%Y-%m-%d'), {run_type: count})
+        self.add_monthly_runs(batch, user_id, date.strftime('%Y-%m'), {run_type: count}, num_shards=num_shards)
+
+    def add_daily_runs(self, batch, date_str: str, counts: Dict[str, int]) -> None:
+        """
+        全ユーザー合計の日次ロールアップへの加算(ラン種別ごとの件数)をバッチに追加します。
+        """
+        increment_merge(
+            batch,
+            db.collection(self.DAILY_COLLECTION_NAME).document(shard_id(date_str, self.DAILY_SHARD_COUNT)),
+            counts,
+            {'date': date_str}
+        )
+
+    def add_monthly_runs(self, batch, user_id: str, month_str: str, counts: Dict[str, int], num_shards: int = 1) -> None:
+        """
+        ユーザーごとの月次ロールアップへの加算(ラン種別ごとの件数)をバッチに追加します。
+        """
+        increment_merge(
+            batch,
+            self._monthly_ref(user_id).document(shard_id(month_str, num_shards)),
+            counts,
+            {'user_id': user_id, 'month': month_str}
+        )
+
+    def get_daily_totals(self, start_date: datetime.date, end_date: datetime.date) -> Dict[str, Any]:
+        """
+        start_dateからend_dateまで(両端を含む)の全ユーザー合計の日次ラン数を取得します。
+        シャードはドキュメントIDの範囲クエリでまとめて読み込み、日付ごとに合計します。
+        """
+        try:
+            if start_date > end_date:
+                return {'status': 'success', 'data': {}}
+            collection_ref = db.collection(self.DAILY_COLLECTION_NAME)
+            docs = self._stream_id_range(collection_ref, start_date.strftime('%Y-%m-%d'), end_date.strftime('%Y-%m-%d'))
+            return {'status': 'success', 'data': sum_shards(docs)}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def list_monthly_totals(self, month: str) -> Dict[str, Any]:
+        """
+        全ユーザーの指定月('YYYY-MM')の月次ラン数を、コレクショングループクエリで取得します。
+        Firestore側で usage_rollups_monthly.month のコレクショングループインデックスを有効にしておく必要があります。
+        """
+        try:
+            docs = db.collection_group(self.MONTHLY_SUBCOLLECTION_NAME).where('month', '==', month).stream()
+            totals = {}
+            for doc in docs:
+                merge_counts(totals.setdefault(doc.reference.parent.parent.id, {}), doc.to_dict())
+            return {'status': 'success', 'data': totals}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    def rebuild(self, daily_counts: Dict[str, Dict[str, int]], monthly_counts: Dict[Tuple[str, str], Dict[str, int]], batch_size: int = 500) -> Dict[str, Any]:
+        """
+        ロールアップを、日次の生データから集計した値で作り直します。
+
+        日次は {'YYYY-MM-DD': {ラン種別: 件数}}、月次は {(UID, 'YYYY-MM'): {ラン種別: 件数}} で渡します。
+        合計はシャードに分けずに元のドキュメントIDへ上書きし、それ以外の既存のロールアップ(シャードや、生データのない日・月)は削除します。
+        実行中に記録されたランは失われることがあるため、ランの記録が止まっている間に実行してください。
+        """
+        try:
+            daily_ref = db.collection(self.DAILY_COLLECTION_NAME)
+            # 書き込み前に既存のドキュメントを列挙し、書き込んだ合計のドキュメントは削除しない
+            existing_refs = [doc.reference for doc in daily_ref.select([]).stream()]
+            existing_refs += [doc.reference for doc in db.collection_group(self.MONTHLY_SUBCOLLECTION_NAME).select([]).stream()]
+
+            written = 0
+            deleted = 0
+            pending = 0
+            batch = db.batch()
+            written_paths = set()
+
+            def flush():
+                nonlocal batch, pending
+                if pending >= batch_size:
+                    batch.commit()
+                    batch = db.batch()
+                    pending = 0
+
+            for date_str, counts in daily_counts.items():
+                doc_ref = daily_ref.document(date_str)
+                batch.set(doc_ref, {**counts, 'date': date_str})
+                written_paths.add(doc_ref.path)
+                written += 1
+                pending += 1
+                flush()
+            for (user_id, month_str), counts in monthly_counts.items():
+                doc_ref = self._monthly_ref(user_id).document(month_str)
+                batch.set(doc_ref, {**counts, 'user_id': user_id, 'month': month_str})
+                written_paths.add(doc_ref.path)
+                written += 1
+                pending += 1
+                flush()
+            for doc_ref in existing_refs:
+                if doc_ref.path in written_paths:
+                    continue
+                batch.delete(doc_ref)
+                deleted += 1
+                pending += 1
+                flush()
+            if pending:
+                batch.commit()
+            return {'status': 'success', 'written': written, 'deleted': deleted}
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+
+    @staticmethod
+    def _stream_id_range(collection_ref, start_id: str, end_id: str):
+        # end_id のシャードも含めるため、上端は end_id の後ろに SHARD_RANGE_END を付けたIDにする
+        document_id = firestore.FieldPath.document_id()
+        return (
+            collection_ref
+            .where(document_id, '>=', collection_ref.document(start_id))
+            .where(document_id, '<=', collection_ref.document(end_id + SHARD_RANGE_END))
+            .order_by(document_id)
+            .stream()
+        )
+
+    def _monthly_ref(self, user_id: str):
+        return db.collection('users').document(user_id).collection(self.MONTHLY_SUBCOLLECTION_NAME)
@@ -0,0 +1,64 @@
+# infrastructure/run_snapshot_repository.py
+import os
+import pyarrow as pa
+import pandas as pd
+from typing import Optional
+
+DEFAULT_SNAPSHOT_DIR = os.path.join('.cache', 'run_snapshot')
+
+
+class RunSnapshotRepository:
+    """
+    ラン数の縦持ちテーブルとユーザー属性を、ローカルディスク上のArrow IPCファイルとして保存します。
+
+    ラン数テーブルのスキーマメタデータに、スナップショットが完全に取り込んでいる最後の日付
+    (high water mark) を 'YYYY-MM-DD' 形式で保持します。
+    """
+    RUNS_FILE_NAME = 'runs.arrow'
+    USERS_FILE_NAME = 'users.arrow'
+    HIGH_WATER_MARK_KEY = b'high_water_mark'
+
+    def __init__(self, snapshot_dir: str = DEFAULT_SNAPSHOT_DIR):
+        self.snapshot_dir = snapshot_dir
+        self.runs_path = os.path.join(snapshot_dir, self.RUNS_FILE_NAME)
+        self.users_path = os.path.join(snapshot_dir, self.USERS_FILE_NAME)
+
+    def exists(self) -> bool:
+        return os.path.exists(self.runs_path) and os.path.exists(self.users_path)
+
+    def get_high_water_mark(self) -> Optional[str]:
+        if not self.exists():
+            return None
+        with pa.memory_map(self.runs_path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        value = metadata.get(self.HIGH_WATER_MARK_KEY)
+        return value.decode('utf-8') if value else None
+
+    def load_runs(self) -> pd.DataFrame:
+        return self._read(self.runs_path)
+
+    def load_users(self) -> pd.DataFrame:
+        return self._read(self.users_path)
+
+    def save(self, runs: pd.DataFrame, users: pd.DataFrame, high_water_mark: str) -> None:
+        os.makedirs(self.snapshot_dir, exist_ok=True)
+        runs_table = pa.Table.from_pandas(runs, preserve_index=False)
+        runs_table = runs_table.replace_schema_metadata({
+            **(runs_table.schema.metadata or {}),
+            self.HIGH_WATER_MARK_KEY: high_water_mark.encode('utf-8'),
+        })
+        self._write(self.users_path, pa.Table.from_pandas(users, preserve_index=False))
+        # high water mark はラン数テーブルに含まれるため、ユーザー属性の後に書き込む
+        self._write(self.runs_path, runs_table)
+
+    def _read(self, path: str) -> pd.DataFrame:
+        # メモリマップで読み込むため、ファイル全体を一度メモリへコピーせずに済む
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all().to_pandas()
+
+    def _write(self, path: str, table: pa.Table) -> None:
+        tmp_path = f"{path}.tmp"
+        with pa.OSFile(tmp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
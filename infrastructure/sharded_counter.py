@@ -0,0 +1,67 @@
+# infrastructure/sharded_counter.py
+import random
+from typing import Any, Dict, Iterable, Iterator, Optional, Tuple
+
+# シャードのドキュメントIDは '{元のドキュメントID}_{シャード番号}'。
+# '_' は '-' や数字より後ろに並ぶため、元のドキュメントとそのシャードはIDの順序で隣り合う。
+SHARD_SEPARATOR = '_'
+# ID範囲クエリの上端に付ける文字。'~' はシャード番号のどの文字よりも後ろに並ぶ。
+SHARD_RANGE_END = '~'
+
+
+def shard_id(base_id: str, num_shards: int) -> str:
+    """
+    num_shards が1以下なら元のドキュメントIDを、それ以外はランダムに選んだシャードのIDを返します。
+    """
+    if num_shards <= 1:
+        return base_id
+    return f"{base_id}{SHARD_SEPARATOR}{random.randrange(num_shards)}"
+
+
+def base_id(doc_id: str) -> str:
+    """
+    シャードのドキュメントIDから元のドキュメントIDを返します。シャードでないIDはそのまま返します。
+    """
+    base, separator, shard = doc_id.rpartition(SHARD_SEPARATOR)
+    return base if separator and shard.isdigit() else doc_id
+
+
+def merge_counts(target: Dict[str, Any], data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    数値のフィールドは足し合わせ、それ以外のフィールドは最初の値を残して data を target にマージします。
+    """
+    for key, value in (data or {}).items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            target[key] = target.get(key, 0) + value
+        else:
+            target.setdefault(key, value)
+    return target
+
+
+def sum_shards(docs: Iterable[Any]) -> Dict[str, Dict[str, Any]]:
+    """
+    ドキュメントを元のドキュメントIDごとに合計し、{元のドキュメントID: データ} として返します。
+    """
+    merged = {}
+    for doc in docs:
+        merge_counts(merged.setdefault(base_id(doc.id), {}), doc.to_dict())
+    return merged
+
+
+def iter_merged_shards(docs: Iterable[Any]) -> Iterator[Tuple[Any, str, Dict[str, Any]]]:
+    """
+    パス順に並んだドキュメントのうち、同じ親の同じ元のドキュメントIDを持つ連続したものを1件にまとめ、
+    (親のドキュメント参照, 元のドキュメントID, 合計したデータ) として返します。
+    """
+    current_key: Optional[Tuple[str, str]] = None
+    current_parent = None
+    current_data: Dict[str, Any] = {}
+    for doc in docs:
+        key = (doc.reference.parent.path, base_id(doc.id))
+        if key != current_key:
+            if current_key is not None:
+                yield current_parent, current_key[1], current_data
+            current_key, current_parent, current_data = key, doc.reference.parent, {}
+        merge_counts(current_data, doc.to_dict())
+    if current_key is not None:
+        yield current_parent, current_key[1], current_data
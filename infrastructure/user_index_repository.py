@@ -2,6 +2,7 @@ from firebase_admin import firestore
 from domain.user_index import UserIndex
 from typing import Dict, Any
 from config.firebase import db
+from infrastructure.firestore_writes import delete_existing, update_existing
 
 class UserIndexRepository:
     def create_user_index(self, user_index: UserIndex) -> Dict[str, Any]:
@@ -19,21 +20,11 @@ class UserIndexRepository:
 
     def update_user_index(self, user_index: UserIndex) -> Dict[str, Any]:
         doc_ref = db.collection('users').document(user_index.user_id).collection('user_index').document(user_index.type)
-        doc = doc_ref.get()
-        if doc.exists:
-            doc_ref.update(user_index.dict(exclude_unset=True))
-            return {'status': 'success'}
-        else:
-            return {'status': 'error', 'message': 'Document not found'}
+        return update_existing(doc_ref, user_index.dict(exclude_unset=True))
 
     def delete_user_index(self, user_id: str, type: str) -> Dict[str, Any]:
         doc_ref = db.collection('users').document(user_id).collection('user_index').document(type)
-        doc = doc_ref.get()
-        if doc.exists:
-            doc_ref.delete()
-            return {'status': 'success'}
-        else:
-            return {'status': 'error', 'message': 'Document not found'}
+        return delete_existing(doc_ref)
 
     def list_user_indices(self, user_id: str) -> Dict[str, Any]:
         docs = db.collection('users').document(user_id).collection('user_index').stream()
@@ -1,47 +1,107 @@
 import requests
 from firebase_admin import firestore
 from domain.user import User
-from typing import Dict, Any
+from typing import Dict, Any, List, Tuple
 import json
 from config.firebase import db, firebase_api_key
+from infrastructure.email_index import get_email_index
 
 class UserRepository:
+    MAX_BATCH_WRITES = 500
+    EMAIL_EXISTS = 'EMAIL_EXISTS'  # 登録済みのメールアドレスでサインアップした場合の Identity Toolkit のエラー
+
+    def __init__(self):
+        self.email_index = get_email_index()
+
     def create_user(self, user: User, password: str) -> Dict[str, Any]:
-        print(user.email)
         try:
-            url = f'https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={firebase_api_key}'
-            payload = {
-                'email': user.email,
-                'password': password,
-                'returnSecureToken': True
-            }
-            response = requests.post(url, data=json.dumps(payload))
-            if response.status_code == 200:
-                user_data = response.json()
-                user.user_id = user_data.get('localId')
+            sign_up_response = self.sign_up(user.email, password)
+            if sign_up_response['status'] == 'success':
+                user.user_id = sign_up_response['user_id']
                 user.created_at = firestore.SERVER_TIMESTAMP
                 db.collection('users').document(user.user_id).set(user.dict())
+                self.email_index.set(user.email, user.user_id)
                 return {'status': 'success', 'user_id': user.user_id}
             else:
-                return {'status': 'error', 'message': response.text}
+                return sign_up_response
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    def create_or_update_user(self, user: User, password: str) -> Dict[str, Any]:
+        """
+        email → UID の索引だけで作成か更新かを決め、Firestoreへの問い合わせなしに書き込みます。
+        """
+        try:
+            user_id = self.email_index.get(user.email)
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+        if user_id is not None:
+            user.user_id = user_id
+            return self.update_user(user)
+        return self._create_or_update_existing(user, password)
+
+    def _create_or_update_existing(self, user: User, password: str) -> Dict[str, Any]:
+        # 他のプロセスが作成したばかりで索引にまだないユーザーはサインアップが EMAIL_EXISTS で失敗するため、そのときだけクエリでUIDを求めて更新する
+        create_response = self.create_user(user, password)
+        if create_response['status'] == 'success' or self.EMAIL_EXISTS not in create_response.get('message', ''):
+            return create_response
+        try:
+            existing_user_response = self._query_user_by_email(user.email)
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}
+        if existing_user_response['status'] != 'success':
+            return create_response
+        user.user_id = existing_user_response['user_id']
+        return self.update_user(user)
+
+    def sign_up(self, email: str, password: str) -> Dict[str, Any]:
+        """
+        Identity Toolkit でアカウントを作成し、UIDを返します。Firestoreには書き込みません。
+        """
+        url = f'https://identitytoolkit.googleapis.com/v1/accounts:signUp?key={firebase_api_key}'
+        payload = {
+            'email': email,
+            'password': password,
+            'returnSecureToken': True
+        }
+        response = requests.post(url, data=json.dumps(payload))
+        if response.status_code == 200:
+            return {'status': 'success', 'user_id': response.json().get('localId')}
+        else:
+            return {'status': 'error', 'message': response.text}
+
     def read_user_by_email(self, email: str) -> Dict[str, Any]:
+        """
+        email → UID の索引でユーザーを探します。索引にある場合はUIDでドキュメントを1件読み込みます。
+        索引は他のプロセスからの作成を最大 ttl_seconds 遅れて反映するため、索引にないメールアドレスはクエリで確認します。
+        """
         try:
-            user_query = db.collection('users').where('email', '==', email).limit(1).get()
-            if user_query:
-                user_doc = user_query[0]
+            user_id = self.email_index.get(email)
+            if user_id is None:
+                return self._query_user_by_email(email)
+            user_doc = db.collection('users').document(user_id).get()
+            if user_doc.exists and user_doc.to_dict().get('email') == email:
                 return {'status': 'success', 'user_data': user_doc.to_dict(), 'user_id': user_doc.id}
-            else:
-                return {'status': 'error', 'message': 'User not found'}
+            # 索引が古い場合はクエリで確認し直す
+            self.email_index.remove(user_id)
+            return self._query_user_by_email(email)
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    def _query_user_by_email(self, email: str) -> Dict[str, Any]:
+        user_query = db.collection('users').where('email', '==', email).limit(1).get()
+        if user_query:
+            user_doc = user_query[0]
+            self.email_index.set(email, user_doc.id)
+            return {'status': 'success', 'user_data': user_doc.to_dict(), 'user_id': user_doc.id}
+        else:
+            return {'status': 'error', 'message': 'User not found'}
+
     def update_user(self, user: User) -> Dict[str, Any]:
         try:
             doc_ref = db.collection('users').document(user.user_id)
-            doc_ref.update(user.dict(exclude_unset=True))
+            doc_ref.update(self._update_data(user))
+            self.email_index.set(user.email, user.user_id)
             return {'status': 'success', 'user_id': user.user_id}
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
@@ -49,10 +109,55 @@ class UserRepository:
     def delete_user(self, user_id: str) -> Dict[str, Any]:
         try:
             db.collection('users').document(user_id).delete()
+            self.email_index.remove(user_id)
             return {'status': 'success'}
         except Exception as e:
             return {'status': 'error', 'message': str(e)}
 
+    def upsert_users(self, users: List[Tuple[User, str]]) -> List[Dict[str, Any]]:
+        """
+        (ユーザー, パスワード) のリストをまとめて登録します。
+
+        既存のユーザーは email → UID の索引で判定し、更新を MAX_BATCH_WRITES 件ずつのバッチで書き込みます。
+        新しいユーザーは create_user で1件ずつサインアップします。他のプロセスが作成済みで索引にまだないユーザーは、サインアップの失敗後に更新します。
+
+        Returns:
+            List[Dict[str, Any]]: 入力順の、ユーザーごとの create_user / update_user と同じ形式の結果。
+        """
+        results: List[Dict[str, Any]] = [None] * len(users)
+        updates = []
+        for i, (user, password) in enumerate(users):
+            try:
+                user_id = self.email_index.get(user.email)
+            except Exception as e:
+                results[i] = {'status': 'error', 'message': str(e)}
+                continue
+            if user_id is None:
+                results[i] = self._create_or_update_existing(user, password)
+            else:
+                user.user_id = user_id
+                updates.append((i, user))
+
+        for start in range(0, len(updates), self.MAX_BATCH_WRITES):
+            chunk = updates[start:start + self.MAX_BATCH_WRITES]
+            try:
+                batch = db.batch()
+                for _, user in chunk:
+                    batch.update(db.collection('users').document(user.user_id), self._update_data(user))
+                batch.commit()
+                for i, user in chunk:
+                    self.email_index.set(user.email, user.user_id)
+                    results[i] = {'status': 'success', 'user_id': user.user_id}
+            except Exception as e:
+                for i, _ in chunk:
+                    results[i] = {'status': 'error', 'message': str(e)}
+        return results
+
+    @staticmethod
+    def _update_data(user: User) -> Dict[str, Any]:
+        # created_at は User の作成時に常に SERVER_TIMESTAMP が入るため、更新では書き込まない
+        return user.dict(exclude_unset=True, exclude={'created_at'})
+
     def verify_user(self, id_token: str) -> Dict[str, Any]:
         try:
             url = f'https://identitytoolkit.googleapis.com/v1/accounts:lookup?key={firebase_api_key}'
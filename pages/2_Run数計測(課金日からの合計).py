@@ -1,118 +1,184 @@
 # payment_run_analysis_page.py
 
+import time
 import streamlit as st
 from datetime import datetime, timedelta, timezone
 import pandas as pd
 from config.firebase import db
 from application.billing_service import BillingService
-from utils.analysis import filter_billing  # フィルタリング関数のインポート
+from application.run_snapshot_service import RunSnapshotService
+from infrastructure.billing_repository import BillingRepository
+from infrastructure.performance_repository import PerformanceRepository
+from utils.analysis import FacetIndex  # フィルタリング用インデックスのインポート
+from utils.cache import TTLFetchCache
+from utils.concurrency import fan_out
+from utils.payment_window import PaymentWindowTotals, cohort_curves
+from utils.run_table import build_long_run_table
 
 # 定数
 DEFAULT_N_DAYS = 7  # デフォルトのn日間
+MAX_N_DAYS = 365  # 支払日から読み込む最大日数
+HORIZON_OPTIONS = [1, 7, 14, 30, 90]  # 横に並べて比較できる期間
+DEFAULT_HORIZONS = [7, 30]
+PAYMENT_USER_COLUMNS = ['UID', 'Display Name', 'Payment Date', 'Plan', 'Billing Status']
+SOURCE_FIRESTORE = 'Firestore'
+SOURCE_FIRESTORE_BULK = 'Firestore(一括)'
+SOURCE_SNAPSHOT = 'ローカルスナップショット'
+DEFAULT_FETCH_CACHE_TTL_MINUTES = 10  # 取得結果のキャッシュ有効期間のデフォルト
+MODE_WINDOW_TOTAL = '期間合計'
+MODE_COHORT = 'コホート分析'
+COHORT_PERIOD_LABELS = {'week': '週', 'month': '月'}
+DEFAULT_COHORT_MAX_DAY = 30
 
-# 日付フォーマットをdatetime型に変換
-def convert_str_to_datetime(date_str):
-    try:
-        # ドキュメントIDが 'YYYY-MM-DD' 形式の場合
-        return datetime.strptime(date_str, '%Y-%m-%d').replace(tzinfo=timezone.utc)
-    except ValueError:
-        # フォーマットが異なる場合はNoneを返す
+# ユーザーの最新のbillingと、支払日から最大期間分のパフォーマンスデータを取得する
+def fetch_user_payment_runs(user_doc, billing_service, max_days):
+    """
+    支払日のないユーザーはNoneを返します。
+    """
+    user_id = user_doc.id
+    user_data = user_doc.to_dict()
+
+    billing_response = billing_service.get_current_billing(user_id, user_data)
+    if billing_response['status'] != 'success':
+        raise RuntimeError(billing_response.get('message'))
+    latest_billing = billing_response['billing_data']
+    if not latest_billing or not latest_billing.get('payment_date'):
         return None
 
-# Firestoreから指定期間中のラン数を取得し合計する
-def fetch_run_counts(user_id, start_date, end_date):
+    payment_date = latest_billing['payment_date']
+    # payment_dateがtimezone-awareでない場合はUTCに設定
+    if payment_date.tzinfo is None:
+        payment_date = payment_date.replace(tzinfo=timezone.utc)
+
+    attributes = {
+        'UID': user_id,
+        'Display Name': user_data.get('display_name', 'Unknown User'),
+        'Payment Date': payment_date,
+        'Plan': latest_billing.get('plan', 'None'),
+        'Billing Status': latest_billing.get('status', 'None'),
+    }
+
+    first_day = payment_date.date()
+    performance_response = PerformanceRepository(user_id).list_runs_between(first_day, first_day + timedelta(days=max_days))
+    if performance_response['status'] != 'success':
+        raise RuntimeError(performance_response['message'])
+    records = [(user_id, doc_id, performance_data) for doc_id, performance_data in performance_response['data'].items()]
+    return attributes, records
+
+# 全てのユーザーのbillingデータと、支払日から最大期間分のラン数をFirestoreから取得する
+def load_payment_run_data(max_days=MAX_N_DAYS):
     """
-    指定ユーザーのパフォーマンスデータを取得し、指定期間中のラン数を合計します。
+    Returns:
+        Tuple[pd.DataFrame, pd.DataFrame, List[Tuple[str, str]]]: 支払日のあるユーザーの属性、縦持ちのラン数テーブル、
+        失敗したユーザーの (UID, エラーメッセージ)。
     """
-    run_types = ['feed_run', 'reel_run', 'feed_theme_run', 'reel_theme_run', 'data_analysis_run']
-    run_counts = {run_type: 0 for run_type in run_types}
-
-    performance_ref = db.collection('users').document(user_id).collection('performance')
-    performance_docs = performance_ref.stream()
+    users_docs = list(db.collection('users').stream())
+    billing_service = BillingService()
+    results, failures = fan_out(users_docs, lambda user_doc: fetch_user_payment_runs(user_doc, billing_service, max_days))
+    results = [result for result in results if result is not None]
 
-    for doc in performance_docs:
-        doc_id = doc.id  # ドキュメントIDを取得
-        performance_data = doc.to_dict()
-        date_obj = convert_str_to_datetime(doc_id)
-        if date_obj and start_date <= date_obj <= end_date:
-            for run_type in run_types:
-                run_counts[run_type] += performance_data.get(run_type, 0)
+    users = pd.DataFrame([attributes for attributes, _ in results], columns=PAYMENT_USER_COLUMNS)
+    users['Payment Date'] = pd.to_datetime(users['Payment Date'], utc=True)
+    runs = build_long_run_table(record for _, records in results for record in records)
+    return users, runs, [(user_doc.id, error) for user_doc, error in failures]
 
-    return run_counts
+# ローカルスナップショットから、billingデータとラン数を読み込む
+def load_payment_run_data_from_snapshot():
+    snapshot_service = RunSnapshotService()
+    if not snapshot_service.is_fresh():
+        refresh_response = snapshot_service.refresh()
+        if refresh_response['status'] != 'success':
+            st.error(f"Failed to refresh run snapshot, Error: {refresh_response['message']}")
+    runs, users = snapshot_service.load()
+    users = users.loc[users['Payment Date'].notna(), PAYMENT_USER_COLUMNS].reset_index(drop=True)
+    return users, runs, []
 
-# 全てのユーザーのbillingデータとラン数を取得し、指定期間中のラン数を合計する
-def get_payment_run_data(n_days):
+# 全ユーザーのbillingとラン数を、ユーザーごとのクエリを使わずに一括で取得する
+def load_payment_run_data_bulk():
     """
-    全てのユーザーからbillingのpayment_dateを取得し、その後n日間のラン数を合計します。
+    ユーザーは current_billing を含めて1本のストリームで、performance は1本のコレクショングループクエリで読み込みます。
+    current_billing をまだ持たないユーザーがいる場合だけ、billing もコレクショングループクエリで読み込み、最新のものを選びます。
     """
-    users_ref = db.collection('users')
-    users_docs = users_ref.stream()
+    user_docs = db.collection('users').select(['display_name', BillingRepository.CURRENT_BILLING_FIELD]).stream()
+    display_names = {}
+    current_billing = []
+    for doc in user_docs:
+        user_data = doc.to_dict() or {}
+        display_names[doc.id] = user_data.get('display_name', 'Unknown User')
+        if BillingRepository.CURRENT_BILLING_FIELD in user_data:
+            current_billing.append({**(user_data[BillingRepository.CURRENT_BILLING_FIELD] or {}), 'user_id': doc.id})
 
-    billing_service = BillingService()
-    all_data = []
-
-    for user_doc in users_docs:
-        user_id = user_doc.id
-        user_data = user_doc.to_dict()
-        display_name = user_data.get('display_name', 'Unknown User')
-
-        # billing情報を取得
-        billing_response = billing_service.list_billing(user_id)
-        if billing_response['status'] == 'success':
-            billing_list = billing_response['billing_list']
-            if billing_list:
-                # payment_dateが存在しない場合も考慮してデフォルト値を設定
-                latest_billing = sorted(
-                    billing_list,
-                    key=lambda x: x.get('payment_date') if x.get('payment_date') else datetime.min.replace(tzinfo=timezone.utc),
-                    reverse=True
-                )[0]
-                payment_date = latest_billing.get('payment_date')
-                plan = latest_billing.get('plan', 'None')
-                status = latest_billing.get('status', 'None')
-
-                if payment_date:
-                    # payment_dateがtimezone-awareでない場合はUTCに設定
-                    if payment_date.tzinfo is None:
-                        payment_date = payment_date.replace(tzinfo=timezone.utc)
-
-                    # payment_dateからn日間の範囲を設定
-                    start_period = payment_date
-                    end_period = payment_date + timedelta(days=n_days)
-
-                    # ラン数を取得
-                    run_counts = fetch_run_counts(user_id, start_period, end_period)
-
-                    # ラン数の合計
-                    run_count_total = sum(run_counts.values())
-
-                    # データを追加
-                    all_data.append({
-                        'UID': user_id,
-                        'Display Name': display_name,
-                        'Payment Date': payment_date.strftime('%Y-%m-%d'),
-                        'Plan': plan,
-                        'Billing Status': status,
-                        'Feed Run': run_counts.get('feed_run', 0),
-                        'Reel Run': run_counts.get('reel_run', 0),
-                        'Feed Theme Run': run_counts.get('feed_theme_run', 0),
-                        'Reel Theme Run': run_counts.get('reel_theme_run', 0),
-                        'Data Analysis Run': run_counts.get('data_analysis_run', 0),
-                        'Run Count Total': run_count_total
-                    })
-            else:
-                # billing_listが空の場合
-                continue
-        else:
-            # billing情報の取得に失敗した場合はスキップ
-            st.error(f"Failed to retrieve billing for User ID: {user_id}, Error: {billing_response.get('message')}")
-            continue
+    billing_list = current_billing
+    if len(current_billing) < len(display_names):
+        billing_response = BillingService().list_all_billing()
+        if billing_response['status'] != 'success':
+            raise RuntimeError(billing_response['message'])
+        summarized = {billing['user_id'] for billing in current_billing}
+        billing_list = current_billing + [billing for billing in billing_response['billing_list'] if billing['user_id'] not in summarized]
+
+    billing = pd.DataFrame(billing_list, columns=['user_id', 'plan', 'status', 'payment_date'])
+    billing['payment_date'] = pd.to_datetime(billing['payment_date'], utc=True, errors='coerce')
+    # payment_dateが最も新しいbillingをユーザーごとに1件選ぶ
+    latest = billing.sort_values('payment_date', na_position='first', kind='stable').drop_duplicates('user_id', keep='last')
+    latest = latest[latest['payment_date'].notna() & latest['user_id'].isin(display_names)].reset_index(drop=True)
+
+    users = pd.DataFrame({
+        'UID': latest['user_id'],
+        'Display Name': latest['user_id'].map(display_names),
+        'Payment Date': latest['payment_date'],
+        'Plan': latest['plan'].fillna('None'),
+        'Billing Status': latest['status'].fillna('None'),
+    }, columns=PAYMENT_USER_COLUMNS)
+
+    if users.empty:
+        return users, build_long_run_table([]), []
+    first_day = users['Payment Date'].min().date()
+    runs = build_long_run_table(PerformanceRepository.stream_all_runs_between(first_day, datetime.now(timezone.utc).date()))
+    return users, runs, []
 
-    return all_data
+# データを読み込み、支払日を起点とした累積和を作成する
+def load_payment_window(data_source):
+    """
+    Returns:
+        Tuple[pd.DataFrame, PaymentWindowTotals, List[Tuple[str, str]]]: ユーザー属性、累積和、失敗したユーザー。
+    """
+    if data_source == SOURCE_SNAPSHOT:
+        users, runs, failures = load_payment_run_data_from_snapshot()
+    elif data_source == SOURCE_FIRESTORE_BULK:
+        users, runs, failures = load_payment_run_data_bulk()
+    else:
+        users, runs, failures = load_payment_run_data()
+    return users, PaymentWindowTotals(users, runs, MAX_N_DAYS), failures
 
 # 表示用のDataFrameを作成
-def prepare_payment_run_dataframe(data):
-    return pd.DataFrame(data)
+def prepare_payment_run_dataframe(users, payment_window, n_days, horizons):
+    """
+    n日間のラン種別ごとの合計に加えて、horizons の各期間の合計を横に並べたDataFrameを作成します。
+    Firestoreへの再取得は行わず、累積和から計算します。
+    """
+    totals = payment_window.totals_frame(n_days)
+    df = pd.DataFrame({
+        'UID': users['UID'].values,
+        'Display Name': users['Display Name'].values,
+        'Payment Date': users['Payment Date'].dt.strftime('%Y-%m-%d').values,
+        'Plan': users['Plan'].values,
+        'Billing Status': users['Billing Status'].values,
+    })
+    for column in totals.columns:
+        df[column] = totals[column].values
+    for horizon, horizon_totals in payment_window.horizon_totals(horizons).items():
+        df[f'Run Count Total ({horizon}日)'] = horizon_totals
+    return df
+
+# 取得結果をデータソースごとに保持する、プロセスに1つのキャッシュ
+@st.cache_resource
+def get_fetch_cache():
+    return TTLFetchCache(ttl_seconds=DEFAULT_FETCH_CACHE_TTL_MINUTES * 60)
+
+# キャッシュの状態を表示用の文字列にする
+def describe_fetch_status(hit, fetched_at):
+    status = "ヒット" if hit else "ミス"
+    return f"キャッシュ{status}: {(time.time() - fetched_at) / 60:.1f}分前に取得したデータです。"
 
 # Streamlit UI
 st.set_page_config(page_title="Payment Run Analysis Dashboard", layout="wide")
@@ -121,25 +187,65 @@ st.title("Payment Run Analysis Dashboard")
 # サイドバーでn日間の選択
 with st.sidebar:
     st.title("フィルター")
-    n_days = st.number_input("Payment Dateからの期間 (日数)", min_value=1, max_value=365, value=DEFAULT_N_DAYS)
+    mode = st.radio("表示モード", options=[MODE_WINDOW_TOTAL, MODE_COHORT])
+    if mode == MODE_COHORT:
+        cohort_period = st.selectbox("コホートの単位", options=list(COHORT_PERIOD_LABELS), format_func=COHORT_PERIOD_LABELS.get)
+        cohort_max_day = st.number_input("Payment Dateからの最大日数", min_value=0, max_value=MAX_N_DAYS, value=DEFAULT_COHORT_MAX_DAY)
+        cohort_split_by = st.multiselect("分割する軸", options=['Plan', 'Run Type'])
+    else:
+        n_days = st.number_input("Payment Dateからの期間 (日数)", min_value=1, max_value=MAX_N_DAYS, value=DEFAULT_N_DAYS)
+        horizons = st.multiselect("比較する期間 (日数)", options=HORIZON_OPTIONS, default=DEFAULT_HORIZONS)
+    data_source = st.radio("データソース", options=[SOURCE_FIRESTORE, SOURCE_FIRESTORE_BULK, SOURCE_SNAPSHOT])
+    cache_ttl_minutes = st.number_input("キャッシュ有効期間 (分)", min_value=0, max_value=1440, value=DEFAULT_FETCH_CACHE_TTL_MINUTES)
+    force_refresh = st.checkbox("キャッシュを使わずに再取得")
     submit_button = st.button("データを取得")
 
 # データの取得をボタン押下時のみ行い、セッションステートに保存
+# 期間の変更では再取得せず、保存済みの累積和から計算し直す
 if submit_button:
     with st.spinner('データを取得中...'):
-        payment_run_data = get_payment_run_data(n_days)
+        fetch_result = get_fetch_cache().get_or_fetch(
+            data_source,
+            lambda: load_payment_window(data_source),
+            ttl_seconds=cache_ttl_minutes * 60,
+            force_refresh=force_refresh
+        )
+        users, payment_window, failures = fetch_result.value
+        st.session_state['payment_run_fetch_status'] = (fetch_result.hit, fetch_result.fetched_at)
+
+        for user_id, error in failures:
+            st.error(f"Failed to retrieve billing for User ID: {user_id}, Error: {error}")
 
-        if not payment_run_data:
+        if users.empty:
             st.warning("指定された条件に該当するデータが見つかりませんでした。")
-            st.session_state['payment_run_df'] = pd.DataFrame()  # 空のDataFrameを保存
+            st.session_state.pop('payment_window', None)
         else:
-            # DataFrameを準備
-            payment_run_df = prepare_payment_run_dataframe(payment_run_data)
-            st.session_state['payment_run_df'] = payment_run_df
+            # 絞り込み用のマスクはデータ取得時に一度だけ作成する(行の並びは表示用DataFrameと同じ)
+            st.session_state['payment_window'] = (users, payment_window, FacetIndex(users))
             st.success("データの取得が完了しました。")
 
+if 'payment_run_fetch_status' in st.session_state:
+    st.caption(describe_fetch_status(*st.session_state['payment_run_fetch_status']))
+
+# コホート分析: 支払日の週・月ごとの1ユーザーあたり累積ラン数
+if 'payment_window' in st.session_state and mode == MODE_COHORT:
+    users, payment_window, _ = st.session_state['payment_window']
+    cohort_df = cohort_curves(users, payment_window, cohort_period, cohort_max_day, cohort_split_by, pd.Timestamp.now(tz='UTC'))
+
+    st.subheader("コホート別 1ユーザーあたり累積ラン数")
+    st.caption("列はPayment Dateからの経過日数です。まだ経過していない日数のユーザーは平均から除外しています。")
+    st.dataframe(cohort_df)
+    st.download_button(
+        label="データをCSVとしてダウンロード",
+        data=cohort_df.to_csv().encode('utf-8'),
+        file_name='payment_cohort_data.csv',
+        mime='text/csv',
+    )
+
 # データが取得されている場合のみ表示
-if 'payment_run_df' in st.session_state and not st.session_state['payment_run_df'].empty:
+elif 'payment_window' in st.session_state:
+    users, payment_window, facet_index = st.session_state['payment_window']
+    payment_run_df = prepare_payment_run_dataframe(users, payment_window, n_days, sorted(horizons))
 
     # 課金プランによる絞り込み
     plan_options = ['feed', 'reel', 'both', 'internal', 'None']
@@ -150,8 +256,10 @@ if 'payment_run_df' in st.session_state and not st.session_state['payment_run_df
     selected_billing_statuses = st.multiselect("課金ステータスで絞り込む", options=billing_status_options, default=billing_status_options)
 
     # フィルタリングを適用
-    filtered_df = st.session_state['payment_run_df']
-    filtered_df = filter_billing(filtered_df, plans=selected_plans, statuses=selected_billing_statuses)
+    filtered_df = payment_run_df[facet_index.mask({
+        'Plan': selected_plans,
+        'Billing Status': selected_billing_statuses,
+    })]
 
     if filtered_df.empty:
         st.warning("指定されたフィルタに該当するデータがありません。")
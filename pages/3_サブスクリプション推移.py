@@ -0,0 +1,93 @@
+# subscription_trend_page.py
+
+import time
+import streamlit as st
+from datetime import datetime, timedelta
+import pandas as pd
+from application.billing_service import BillingService
+from utils.cache import TTLFetchCache
+from utils.subscription import daily_active_subscriptions, plan_mix
+
+# 定数
+DEFAULT_PERIOD_DAYS = 90  # デフォルトの表示期間
+BILLING_COLUMNS = ['billing_id', 'user_id', 'plan', 'status', 'payment_date', 'cancellation_date']
+DEFAULT_FETCH_CACHE_TTL_MINUTES = 10  # 取得結果のキャッシュ有効期間のデフォルト
+BILLING_CACHE_KEY = 'all_billing'
+
+# 全ユーザーのbillingを1回のコレクショングループクエリで取得する
+def load_all_billing():
+    billing_response = BillingService().list_all_billing()
+    if billing_response['status'] != 'success':
+        raise RuntimeError(billing_response['message'])
+    billing = pd.DataFrame(billing_response['billing_list'], columns=BILLING_COLUMNS)
+    billing['payment_date'] = pd.to_datetime(billing['payment_date'], errors='coerce', utc=True)
+    billing['cancellation_date'] = pd.to_datetime(billing['cancellation_date'], errors='coerce', utc=True)
+    return billing
+
+# 取得結果を保持する、プロセスに1つのキャッシュ
+@st.cache_resource
+def get_fetch_cache():
+    return TTLFetchCache(ttl_seconds=DEFAULT_FETCH_CACHE_TTL_MINUTES * 60)
+
+# キャッシュの状態を表示用の文字列にする
+def describe_fetch_status(hit, fetched_at):
+    status = "ヒット" if hit else "ミス"
+    return f"キャッシュ{status}: {(time.time() - fetched_at) / 60:.1f}分前に取得したデータです。"
+
+# Streamlit UI
+st.set_page_config(page_title="Subscription Trend Dashboard", layout="wide")
+st.title("Subscription Trend Dashboard")
+
+# サイドバーで期間の選択
+with st.sidebar:
+    st.title("フィルター")
+    today = datetime.now().date()
+    start_date = st.date_input("開始日", value=today - timedelta(days=DEFAULT_PERIOD_DAYS))
+    end_date = st.date_input("終了日", value=today)
+    cache_ttl_minutes = st.number_input("キャッシュ有効期間 (分)", min_value=0, max_value=1440, value=DEFAULT_FETCH_CACHE_TTL_MINUTES)
+    force_refresh = st.checkbox("キャッシュを使わずに再取得")
+    submit_button = st.button("データを取得")
+
+# billingの取得はボタン押下時のみ行い、期間の変更では保存済みのデータから計算し直す
+if submit_button:
+    with st.spinner('データを取得中...'):
+        try:
+            fetch_result = get_fetch_cache().get_or_fetch(
+                BILLING_CACHE_KEY,
+                load_all_billing,
+                ttl_seconds=cache_ttl_minutes * 60,
+                force_refresh=force_refresh
+            )
+            st.session_state['all_billing'] = fetch_result.value
+            st.session_state['billing_fetch_status'] = (fetch_result.hit, fetch_result.fetched_at)
+            st.success("データの取得が完了しました。")
+        except Exception as e:
+            st.error(f"Failed to retrieve billing: {e}")
+
+if 'billing_fetch_status' in st.session_state:
+    st.caption(describe_fetch_status(*st.session_state['billing_fetch_status']))
+
+if 'all_billing' in st.session_state:
+    if start_date > end_date:
+        st.error("開始日は終了日より前の日付を指定してください。")
+    else:
+        active_df = daily_active_subscriptions(st.session_state['all_billing'], start_date, end_date)
+
+        if active_df.empty or not active_df.to_numpy().any():
+            st.warning("指定された期間に有効な契約がありません。")
+        else:
+            st.subheader("プラン別 契約ユーザー数")
+            st.caption("各 billing の payment_date から、cancellation_date または同じユーザーの次の payment_date の前日までを契約中として、ユーザーごとに1日1件数えています。")
+            st.line_chart(active_df.assign(Total=active_df.sum(axis=1)))
+
+            st.subheader("プラン構成比")
+            mix_df = plan_mix(active_df)
+            st.area_chart(mix_df)
+
+            st.dataframe(active_df)
+            st.download_button(
+                label="データをCSVとしてダウンロード",
+                data=active_df.to_csv().encode('utf-8'),
+                file_name='subscription_trend_data.csv',
+                mime='text/csv',
+            )
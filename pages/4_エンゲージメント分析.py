@@ -0,0 +1,97 @@
+# engagement_analysis_page.py
+
+import time
+import streamlit as st
+from datetime import datetime, timedelta
+import pandas as pd
+from application.insight_service import InsightService
+from utils.cache import TTLFetchCache
+from utils.engagement import (
+    ENGAGEMENT_METRICS, INSIGHT_FIELDS,
+    add_engagement_rates, build_insight_table, rolling_trend, user_percentiles,
+)
+
+# 定数
+DEFAULT_PERIOD_DAYS = 180  # デフォルトの表示期間
+DEFAULT_WINDOW_DAYS = 7  # 推移の移動窓のデフォルト
+METRIC_LABELS = {'save_rate': '保存率', 'like_rate': 'いいね率', 'new_reach_ratio': '新規リーチ率'}
+DEFAULT_FETCH_CACHE_TTL_MINUTES = 30  # 取得結果のキャッシュ有効期間のデフォルト
+INSIGHT_CACHE_KEY = 'all_insights'
+
+# 全ユーザーのインサイトを、指標の計算に必要なフィールドだけ1回のコレクショングループクエリで列指向に読み込む
+def load_insight_table():
+    insights = build_insight_table(InsightService().stream_all_insights(fields=INSIGHT_FIELDS, columnar=True))
+    return add_engagement_rates(insights)
+
+# 取得結果を保持する、プロセスに1つのキャッシュ
+@st.cache_resource
+def get_fetch_cache():
+    return TTLFetchCache(ttl_seconds=DEFAULT_FETCH_CACHE_TTL_MINUTES * 60)
+
+# キャッシュの状態を表示用の文字列にする
+def describe_fetch_status(hit, fetched_at):
+    status = "ヒット" if hit else "ミス"
+    return f"キャッシュ{status}: {(time.time() - fetched_at) / 60:.1f}分前に取得したデータです。"
+
+# posted_at が期間内(両端の日を含む)の投稿に絞り込む
+def filter_posted_between(insights, start_date, end_date):
+    posted_date = insights['posted_at'].dt.tz_convert(None)
+    return insights[(posted_date >= pd.Timestamp(start_date)) & (posted_date < pd.Timestamp(end_date) + pd.Timedelta(days=1))]
+
+# Streamlit UI
+st.set_page_config(page_title="Engagement Analysis Dashboard", layout="wide")
+st.title("Engagement Analysis Dashboard")
+
+# サイドバーで期間と指標の選択
+with st.sidebar:
+    st.title("フィルター")
+    today = datetime.now().date()
+    start_date = st.date_input("開始日 (posted_at)", value=today - timedelta(days=DEFAULT_PERIOD_DAYS))
+    end_date = st.date_input("終了日 (posted_at)", value=today)
+    window_days = st.number_input("推移の移動窓 (日数)", min_value=1, max_value=90, value=DEFAULT_WINDOW_DAYS)
+    selected_metrics = st.multiselect("指標", options=list(ENGAGEMENT_METRICS), default=list(ENGAGEMENT_METRICS), format_func=METRIC_LABELS.get)
+    cache_ttl_minutes = st.number_input("キャッシュ有効期間 (分)", min_value=0, max_value=1440, value=DEFAULT_FETCH_CACHE_TTL_MINUTES)
+    force_refresh = st.checkbox("キャッシュを使わずに再取得")
+    submit_button = st.button("データを取得")
+
+# インサイトの取得はボタン押下時のみ行い、期間や指標の変更では保存済みのテーブルから計算し直す
+if submit_button:
+    with st.spinner('データを取得中...'):
+        try:
+            fetch_result = get_fetch_cache().get_or_fetch(
+                INSIGHT_CACHE_KEY,
+                load_insight_table,
+                ttl_seconds=cache_ttl_minutes * 60,
+                force_refresh=force_refresh
+            )
+            st.session_state['insight_table'] = fetch_result.value
+            st.session_state['insight_fetch_status'] = (fetch_result.hit, fetch_result.fetched_at)
+            st.success("データの取得が完了しました。")
+        except Exception as e:
+            st.error(f"Failed to retrieve insights: {e}")
+
+if 'insight_fetch_status' in st.session_state:
+    st.caption(describe_fetch_status(*st.session_state['insight_fetch_status']))
+
+if 'insight_table' in st.session_state:
+    insights = filter_posted_between(st.session_state['insight_table'], start_date, end_date)
+
+    if insights.empty or not selected_metrics:
+        st.warning("指定された条件に該当するデータが見つかりませんでした。")
+    else:
+        st.subheader(f"指標の推移 (直近{window_days}日間)")
+        st.caption("各指標は期間内の投稿の合計から求めています(例: 保存率 = 保存数の合計 / リーチ数の合計)。")
+        trend_df = rolling_trend(insights, window_days, selected_metrics)
+        st.line_chart(trend_df[selected_metrics].rename(columns=METRIC_LABELS))
+
+        st.subheader("ユーザー別 指標の分布")
+        st.caption("投稿ごとの指標のパーセンタイルです。リーチが0の投稿は除外しています。")
+        percentile_df = user_percentiles(insights, selected_metrics).sort_values('Posts', ascending=False)
+        st.dataframe(percentile_df)
+
+        st.download_button(
+            label="データをCSVとしてダウンロード",
+            data=percentile_df.to_csv().encode('utf-8'),
+            file_name='engagement_percentile_data.csv',
+            mime='text/csv',
+        )
@@ -0,0 +1,55 @@
+# bulk_onboarding_page.py
+
+import streamlit as st
+import pandas as pd
+from application.bulk_onboarding_service import (
+    BulkOnboardingService, ONBOARDING_COLUMNS,
+    DEFAULT_SIGN_UP_RATE_PER_SECOND, DEFAULT_SIGN_UP_WORKERS, parse_onboarding_rows,
+)
+
+# 定数
+FILE_FORMATS = {'csv': 'csv', 'jsonl': 'jsonl'}  # 拡張子: 形式
+RESULT_COLUMNS = ['row', 'email', 'status', 'user_id', 'billing_id', 'message']
+
+# Streamlit UI
+st.set_page_config(page_title="Bulk Onboarding", layout="wide")
+st.title("Bulk Onboarding")
+st.caption(f"CSV(ヘッダー行あり)または JSONL で、次の列を指定してください: {', '.join(ONBOARDING_COLUMNS)}。"
+           "plan を指定した行は billing も登録します。status を省略した billing は、cancellation_date を過ぎていれば cancelled、それ以外は active になります。"
+           "登録済みのメールアドレスはサインアップせずに、指定した列だけを更新します。")
+
+with st.sidebar:
+    st.title("設定")
+    sign_up_rate = st.number_input("サインアップの上限 (件/秒)", min_value=1, max_value=100, value=DEFAULT_SIGN_UP_RATE_PER_SECOND)
+    sign_up_workers = st.number_input("サインアップの並列数", min_value=1, max_value=64, value=DEFAULT_SIGN_UP_WORKERS)
+
+uploaded_file = st.file_uploader("ファイルを選択", type=list(FILE_FORMATS))
+
+if uploaded_file is not None and st.button("一括登録を実行"):
+    try:
+        file_format = FILE_FORMATS[uploaded_file.name.rsplit('.', 1)[-1].lower()]
+        rows = parse_onboarding_rows(uploaded_file.getvalue().decode('utf-8'), file_format)
+    except Exception as e:
+        st.error(f"Failed to read file: {e}")
+        rows = None
+
+    if rows is not None:
+        with st.spinner(f'{len(rows)}件を登録中...'):
+            service = BulkOnboardingService(sign_up_rate_per_second=sign_up_rate, sign_up_workers=int(sign_up_workers))
+            st.session_state['onboarding_results'] = pd.DataFrame(service.import_rows(rows), columns=RESULT_COLUMNS)
+
+if 'onboarding_results' in st.session_state:
+    results_df = st.session_state['onboarding_results']
+    succeeded = int((results_df['status'] == 'success').sum())
+    if succeeded == len(results_df):
+        st.success(f"{succeeded}件すべての登録が完了しました。")
+    else:
+        st.warning(f"{len(results_df)}件中 {succeeded}件が成功し、{len(results_df) - succeeded}件が失敗しました。")
+
+    st.dataframe(results_df)
+    st.download_button(
+        label="結果をCSVとしてダウンロード",
+        data=results_df.to_csv(index=False).encode('utf-8'),
+        file_name='onboarding_results.csv',
+        mime='text/csv',
+    )
@@ -1,7 +1,8 @@
 # utils/analysis.py
 
+import numpy as np
 import pandas as pd
-from typing import List, Optional
+from typing import Dict, Iterable, List, Optional
 
 def filter_users_by_plan(df: pd.DataFrame, plans: Optional[List[str]] = None) -> pd.DataFrame:
     """
@@ -50,3 +51,76 @@ def filter_billing(df: pd.DataFrame, plans: Optional[List[str]] = None, statuses
     if statuses:
         df = filter_users_by_billing_status(df, statuses)
     return df
+
+
+class FacetIndex:
+    """
+    DataFrameの絞り込み用の列(ファセット)ごとに、値→行のbooleanマスクを一度だけ計算して保持します。
+
+    絞り込みは保持しているマスクのビット演算だけで行うため、Streamlitの再実行のたびに
+    DataFrame全体を走査する必要がありません。ファセットは add_facet で列名を指定するだけで追加できます。
+    """
+    DEFAULT_FACETS = ('Plan', 'Billing Status', 'Run Type')
+
+    def __init__(self, df: pd.DataFrame, facets: Iterable[str] = DEFAULT_FACETS):
+        self.df = df
+        self._masks: Dict[str, Dict[object, np.ndarray]] = {}
+        for facet in facets:
+            if facet in df.columns:
+                self.add_facet(facet)
+
+    def add_facet(self, column: str) -> None:
+        """
+        指定した列をファセットとして追加し、値ごとのマスクを計算します。
+        """
+        codes, uniques = pd.factorize(self.df[column])
+        self._masks[column] = {value: codes == i for i, value in enumerate(uniques)}
+
+    @property
+    def facets(self) -> List[str]:
+        return list(self._masks)
+
+    def values(self, column: str) -> List[object]:
+        """
+        ファセットに含まれる値の一覧を返します。
+        """
+        return list(self._masks[column])
+
+    def mask(self, selections: Dict[str, Optional[List[object]]]) -> np.ndarray:
+        """
+        ファセットごとの選択値から、該当する行を示すbooleanマスクを返します。
+
+        Args:
+            selections (Dict[str, Optional[List[object]]]): 列名→選択値のリスト。Noneまたは空の場合、その列では絞り込みません。
+
+        Returns:
+            np.ndarray: 同じファセット内の値はOR、ファセット間はANDで組み合わせたマスク。
+        """
+        result = np.ones(len(self.df), dtype=bool)
+        for column, selected in selections.items():
+            if not selected:
+                continue
+            facet_mask = np.zeros(len(self.df), dtype=bool)
+            value_masks = self._masks[column]
+            for value in selected:
+                if value in value_masks:
+                    facet_mask |= value_masks[value]
+            result &= facet_mask
+        return result
+
+    def filter(self, selections: Dict[str, Optional[List[object]]]) -> pd.DataFrame:
+        """
+        ファセットごとの選択値でDataFrameを絞り込みます。
+
+        Args:
+            selections (Dict[str, Optional[List[object]]]): 列名→選択値のリスト。Noneまたは空の場合、その列では絞り込みません。
+
+        Returns:
+            pd.DataFrame: フィルタリングされたDataFrame。
+        """
+        return self.df[self.mask(selections)]
+
+    @property
+    def nbytes(self) -> int:
+        mask_bytes = sum(mask.nbytes for value_masks in self._masks.values() for mask in value_masks.values())
+        return int(self.df.memory_usage(index=True, deep=True).sum()) + mask_bytes
@@ -0,0 +1,184 @@
+# utils/cache.py
+
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+
+import pandas as pd
+
+
+def dataframe_nbytes(df: pd.DataFrame) -> int:
+    """
+    DataFrameが使用するメモリ量(バイト)を返します。object列の中身も含みます。
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class LRUCache:
+    """
+    エントリ数とメモリ使用量に上限を持つ、スレッドセーフなLRUキャッシュ。
+
+    Streamlitのセッション間で共有するため、st.cache_resource などでプロセスに1つだけ作成して使います。
+    上限を超えた場合は、最も長く参照されていないエントリから破棄します。
+    """
+    def __init__(self, max_entries: int = 128, max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = sys.getsizeof):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._total_bytes = 0
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        size = self.sizeof(value)
+        with self._lock:
+            self._remove(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                # 単体で上限を超える値はキャッシュしない
+                return
+            self._entries[key] = value
+            self._sizes[key] = size
+            self._total_bytes += size
+            self._evict()
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            value = self._entries.get(key, default)
+            self._remove(key)
+            return value
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._total_bytes = 0
+
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _remove(self, key: Hashable) -> None:
+        if key in self._entries:
+            del self._entries[key]
+            self._total_bytes -= self._sizes.pop(key)
+
+    def _evict(self) -> None:
+        while len(self._entries) > self.max_entries or (self.max_bytes is not None and self._total_bytes > self.max_bytes):
+            oldest_key = next(iter(self._entries))
+            self._remove(oldest_key)
+
+
+class FetchResult(NamedTuple):
+    value: Any
+    fetched_at: float
+    hit: bool
+
+    @property
+    def age_seconds(self) -> float:
+        return time.time() - self.fetched_at
+
+
+class TTLFetchCache:
+    """
+    パラメータをキーとして取得結果を保持し、有効期間(TTL)内であれば再取得せずに返すキャッシュ。
+
+    同じキーの取得が同時に要求された場合、実際の取得は1回だけ行い、他の要求はその結果を待って共有します。
+    ヒット数・ミス数は stats で参照できます。
+    """
+    def __init__(self, ttl_seconds: float, max_entries: int = 32, max_bytes: Optional[int] = None, sizeof: Callable[[Any], int] = sys.getsizeof):
+        self.ttl_seconds = ttl_seconds
+        self._store = LRUCache(max_entries=max_entries, max_bytes=max_bytes, sizeof=lambda entry: sizeof(entry[0]))
+        self._inflight: Dict[Hashable, Future] = {}
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], Any], ttl_seconds: Optional[float] = None, force_refresh: bool = False) -> FetchResult:
+        """
+        キャッシュが有効期間内であればその値を返し、そうでなければ fetch を呼び出して取得します。
+
+        Args:
+            key (Hashable): 取得パラメータから作るキー。
+            fetch (Callable[[], Any]): キャッシュがない場合に値を取得する関数。
+            ttl_seconds (float, optional): この呼び出しで使う有効期間。Noneの場合はキャッシュの既定値。
+            force_refresh (bool, optional): Trueの場合、有効期間内のキャッシュがあっても再取得します。
+
+        Returns:
+            FetchResult: 値、取得時刻、キャッシュヒットかどうか。
+        """
+        ttl_seconds = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            entry = self._store.get(key)
+            if entry is not None and not force_refresh and time.time() - entry[1] < ttl_seconds:
+                self._hits += 1
+                return FetchResult(entry[0], entry[1], True)
+
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner:
+                self._misses += 1
+                future = Future()
+                self._inflight[key] = future
+            else:
+                self._hits += 1
+
+        if not owner:
+            # 同じキーを取得中の要求があれば、その結果を共有する
+            value, fetched_at = future.result()
+            return FetchResult(value, fetched_at, True)
+
+        try:
+            value = fetch()
+            fetched_at = time.time()
+            with self._lock:
+                # 取得中に invalidate された場合、取得した値は古い可能性があるため保存しない
+                if self._inflight.get(key) is future:
+                    self._store.put(key, (value, fetched_at))
+            future.set_result((value, fetched_at))
+            return FetchResult(value, fetched_at, False)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                if self._inflight.get(key) is future:
+                    del self._inflight[key]
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        キーのキャッシュを破棄します。取得中の要求があれば、その結果もキャッシュに保存されなくなります。
+        """
+        with self._lock:
+            self._store.pop(key)
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        ヒット数、ミス数、ヒット率、保持しているエントリ数を返します。
+        """
+        with self._lock:
+            requests = self._hits + self._misses
+            return {
+                'hits': self._hits,
+                'misses': self._misses,
+                'hit_rate': self._hits / requests if requests else 0.0,
+                'entries': len(self._store),
+            }
@@ -0,0 +1,92 @@
+# utils/concurrency.py
+
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_MAX_WORKERS = 16  # Firestoreへの同時リクエスト数のデフォルト
+
+
+def iter_fan_out(items: Iterable[Any], func: Callable[[Any], Any], max_workers: int = DEFAULT_MAX_WORKERS) -> Iterator[Tuple[Any, Any, Optional[str]]]:
+    """
+    itemsの各要素にfuncをスレッドプールで並列に適用し、入力順に結果を返します。
+
+    同時に処理中となる要素数は max_workers の2倍までに制限されるため、
+    大量の要素を渡してもメモリ使用量は一定に保たれます。
+
+    Args:
+        items (Iterable[Any]): 処理対象の要素。
+        func (Callable[[Any], Any]): 各要素に適用する関数。
+        max_workers (int, optional): 並列実行するワーカー数。デフォルトはDEFAULT_MAX_WORKERS。
+
+    Yields:
+        Tuple[Any, Any, Optional[str]]: (要素, 結果, エラーメッセージ)。成功時のエラーメッセージはNone、失敗時の結果はNone。
+    """
+    max_workers = max(1, int(max_workers))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append((item, executor.submit(func, item)))
+            if len(pending) >= max_workers * 2:
+                yield _resolve(*pending.popleft())
+        while pending:
+            yield _resolve(*pending.popleft())
+
+
+def _resolve(item: Any, future) -> Tuple[Any, Any, Optional[str]]:
+    try:
+        return item, future.result(), None
+    except Exception as e:
+        return item, None, str(e)
+
+
+def fan_out(items: Iterable[Any], func: Callable[[Any], Any], max_workers: int = DEFAULT_MAX_WORKERS) -> Tuple[List[Any], List[Tuple[Any, str]]]:
+    """
+    itemsの各要素にfuncを並列に適用し、成功した結果と失敗した要素を分けて返します。
+
+    一部の要素で例外が発生しても処理全体は中断されません。
+
+    Args:
+        items (Iterable[Any]): 処理対象の要素。
+        func (Callable[[Any], Any]): 各要素に適用する関数。
+        max_workers (int, optional): 並列実行するワーカー数。デフォルトはDEFAULT_MAX_WORKERS。
+
+    Returns:
+        Tuple[List[Any], List[Tuple[Any, str]]]: 入力順の成功結果のリストと、(要素, エラーメッセージ) のリスト。
+    """
+    results = []
+    failures = []
+    for item, result, error in iter_fan_out(items, func, max_workers):
+        if error is None:
+            results.append(result)
+        else:
+            failures.append((item, error))
+    return results, failures
+
+
+class RateLimiter:
+    """
+    1秒あたりの呼び出し回数を制限する、スレッドセーフなトークンバケット。
+
+    acquire はトークンが空くまで待ってから戻ります。burst 回までは待たずに連続して呼び出せます。
+    """
+    def __init__(self, rate_per_second: float, burst: int = 1):
+        self.rate_per_second = rate_per_second
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate_per_second)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate_per_second
+            time.sleep(wait)
@@ -0,0 +1,127 @@
+# utils/engagement.py
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+from typing import Any, Dict, Iterable, List, Sequence, Union
+
+INSIGHT_COUNT_COLUMNS = ['reach_count', 'followers_reach_count', 'new_reach_count', 'like_count', 'save_count']
+INSIGHT_FIELDS = ['posted_at'] + INSIGHT_COUNT_COLUMNS
+INSIGHT_TABLE_COLUMNS = ['user_id', 'post_id'] + INSIGHT_FIELDS
+
+# 指標名: (分子の列, 分母の列)
+ENGAGEMENT_METRICS = {
+    'save_rate': ('save_count', 'reach_count'),
+    'like_rate': ('like_count', 'reach_count'),
+    'new_reach_ratio': ('new_reach_count', 'reach_count'),
+}
+DEFAULT_PERCENTILES = (0.25, 0.5, 0.75, 0.9)
+POSTED_AT_DTYPE = 'datetime64[ns, UTC]'
+
+def build_insight_table(batches: Iterable[Union[List[Dict[str, Any]], pa.RecordBatch]]) -> pd.DataFrame:
+    """
+    インサイトのバッチを、1投稿1行の列指向のDataFrameに変換します。
+
+    InsightRepository.stream_all_insights(fields=INSIGHT_FIELDS) のバッチをそのまま渡せます。
+    columnar=True で取得したArrowのRecordBatchは、辞書を経由せずにまとめてDataFrameに変換します。
+    件数の列は欠損を0としてint64に、posted_at はUTCのdatetimeに、user_id はカテゴリ型に変換します。
+
+    Args:
+        batches (Iterable[Union[List[Dict[str, Any]], pa.RecordBatch]]): インサイトの辞書のリスト、またはRecordBatchのイテラブル。
+
+    Returns:
+        pd.DataFrame: INSIGHT_TABLE_COLUMNS の列を持つDataFrame。
+    """
+    frames = []
+    arrow_batches = []
+    for batch in batches:
+        if isinstance(batch, pa.RecordBatch):
+            arrow_batches.append(batch)
+        elif batch:
+            frames.append(pd.DataFrame.from_records(batch, columns=INSIGHT_TABLE_COLUMNS))
+    if arrow_batches:
+        frames.append(_arrow_to_frame(pa.Table.from_batches(arrow_batches)))
+    insights = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=INSIGHT_TABLE_COLUMNS)
+    for column in INSIGHT_COUNT_COLUMNS:
+        insights[column] = pd.to_numeric(insights[column], errors='coerce').fillna(0).astype('int64')
+    insights['posted_at'] = _to_utc_datetime(insights['posted_at'])
+    insights['user_id'] = insights['user_id'].astype('category')
+    return insights
+
+def add_engagement_rates(insights: pd.DataFrame) -> pd.DataFrame:
+    """
+    投稿ごとの ENGAGEMENT_METRICS の列を追加したDataFrameを返します。リーチが0の投稿はNaNになります。
+    """
+    insights = insights.copy()
+    for metric, (numerator, denominator) in ENGAGEMENT_METRICS.items():
+        insights[metric] = _ratio(insights[numerator].to_numpy(), insights[denominator].to_numpy())
+    return insights
+
+def user_percentiles(insights: pd.DataFrame, metrics: Sequence[str] = tuple(ENGAGEMENT_METRICS), percentiles: Sequence[float] = DEFAULT_PERCENTILES) -> pd.DataFrame:
+    """
+    ユーザーごとに、投稿単位の指標のパーセンタイルを求めます。
+
+    Args:
+        insights (pd.DataFrame): add_engagement_rates で指標を追加したDataFrame。
+        metrics (Sequence[str], optional): 対象の指標。
+        percentiles (Sequence[float], optional): 0〜1で指定するパーセンタイル。
+
+    Returns:
+        pd.DataFrame: user_id をインデックスとし、Posts 列と '{指標} p{パーセンタイル}' の列を持つDataFrame。
+    """
+    grouped = insights.groupby('user_id', observed=True)
+    quantiles = grouped[list(metrics)].quantile(list(percentiles)).unstack()
+    quantiles.columns = [f"{metric} p{round(percentile * 100)}" for metric, percentile in quantiles.columns]
+    return pd.concat([grouped.size().rename('Posts'), quantiles], axis=1)
+
+def rolling_trend(insights: pd.DataFrame, window_days: int = 7, metrics: Sequence[str] = tuple(ENGAGEMENT_METRICS)) -> pd.DataFrame:
+    """
+    posted_at の日ごとに、直近 window_days 日間の指標の推移を求めます。
+
+    各指標は投稿ごとの率の平均ではなく、期間内の分子の合計 / 分母の合計として求めるため、リーチの大きい投稿ほど重く数えます。
+
+    Args:
+        insights (pd.DataFrame): build_insight_table が返すDataFrame。
+        window_days (int, optional): 移動窓の日数。
+        metrics (Sequence[str], optional): 対象の指標。
+
+    Returns:
+        pd.DataFrame: 日付をインデックスとし、Posts 列(期間内の投稿数)と指標の列を持つDataFrame。
+    """
+    dated = insights[insights['posted_at'].notna()]
+    if dated.empty:
+        return pd.DataFrame(columns=['Posts'] + list(metrics))
+
+    columns = sorted({column for metric in metrics for column in ENGAGEMENT_METRICS[metric]})
+    day = dated['posted_at'].dt.tz_convert(None).dt.normalize()
+    daily = dated[columns].groupby(day).sum()
+    daily['Posts'] = day.value_counts()
+    days = pd.date_range(daily.index.min(), daily.index.max(), freq='D')
+    window = daily.reindex(days, fill_value=0).rolling(window_days, min_periods=1).sum()
+
+    trend = pd.DataFrame({'Posts': window['Posts'].astype('int64')}, index=days.date)
+    for metric in metrics:
+        numerator, denominator = ENGAGEMENT_METRICS[metric]
+        trend[metric] = _ratio(window[numerator].to_numpy(), window[denominator].to_numpy())
+    trend.index.name = 'Date'
+    return trend
+
+def _to_utc_datetime(values: pd.Series) -> pd.Series:
+    # 古いドキュメントは posted_at をUNIX時間(秒)の数値で持っているため、数値は秒として、それ以外は日時として変換する
+    if values.dtype.kind == 'M':
+        return pd.to_datetime(values, utc=True).astype(POSTED_AT_DTYPE)
+    seconds = pd.to_numeric(values, errors='coerce')
+    is_number = seconds.notna()
+    converted = pd.to_datetime(values.where(~is_number), errors='coerce', utc=True).astype(POSTED_AT_DTYPE)
+    converted[is_number] = pd.to_datetime(seconds[is_number], unit='s', utc=True)
+    return converted
+
+def _arrow_to_frame(table: pa.Table) -> pd.DataFrame:
+    # user_id は辞書エンコードしてからpandasに渡し、ユーザーIDの文字列を投稿の数だけ作らないようにする
+    table = table.set_column(table.schema.get_field_index('user_id'), 'user_id', table['user_id'].dictionary_encode())
+    return table.to_pandas().reindex(columns=INSIGHT_TABLE_COLUMNS)
+
+def _ratio(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    numerator = numerator.astype('float64')
+    denominator = denominator.astype('float64')
+    return np.divide(numerator, denominator, out=np.full(len(numerator), np.nan), where=denominator > 0)
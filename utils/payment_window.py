@@ -0,0 +1,136 @@
+# utils/payment_window.py
+
+import numpy as np
+import pandas as pd
+from typing import Dict, List
+from domain.performance import RUN_TYPE_LABELS
+
+class PaymentWindowTotals:
+    """
+    ユーザーごとの日次ラン数を、支払日を0日目とする累積和の配列に変換して保持します。
+
+    一度構築すれば、任意の日数 n に対する「支払日から n 日間のラン数合計」を、
+    ユーザー・期間ごとに累積和の差分1回(O(1))で求められます。
+
+    期間の数え方は従来の集計と同じで、日付(UTCの0時)が支払日時以上かつ支払日時+n日以下の日を含みます。
+    つまり支払日時が0時ちょうどでない場合、支払日当日は含まれません。
+    """
+    def __init__(self, users: pd.DataFrame, runs: pd.DataFrame, max_days: int):
+        """
+        Args:
+            users (pd.DataFrame): UID と Payment Date (UTCのTimestamp) 列を持つDataFrame。
+            runs (pd.DataFrame): UID, Date, Run Type, Count 列を持つ縦持ちのDataFrame。
+            max_days (int): 求める期間の最大日数。
+        """
+        self.run_types = list(RUN_TYPE_LABELS.values())
+        self.max_days = max_days
+        self.uids = pd.Index(users['UID'])
+
+        payment_date = pd.to_datetime(users['Payment Date'], utc=True)
+        base_day = payment_date.dt.normalize()
+        # 支払日時が0時ちょうどでなければ、翌日(1日目)から数える
+        self.start_offset = (payment_date != base_day).to_numpy().astype(np.int64)
+
+        n_users, n_types, n_days = len(users), len(self.run_types), max_days + 1
+        user_pos = self.uids.get_indexer(runs['UID'])
+        type_pos = pd.Index(self.run_types).get_indexer(runs['Run Type'])
+        valid = (user_pos >= 0) & (type_pos >= 0)
+
+        # 日付を1970-01-01からの日数に変換し、支払日からの経過日数を求める
+        base_day_number = base_day.dt.tz_localize(None).to_numpy().astype('datetime64[D]').astype(np.int64)
+        run_day_number = np.asarray(runs['Date'].to_numpy()[valid], dtype='datetime64[D]').astype(np.int64)
+        day_pos = run_day_number - base_day_number[user_pos[valid]]
+        in_window = (day_pos >= 0) & (day_pos < n_days)
+
+        cell = ((user_pos[valid][in_window] * n_types + type_pos[valid][in_window]) * n_days + day_pos[in_window])
+        daily = np.bincount(
+            cell,
+            weights=runs['Count'].to_numpy()[valid][in_window],
+            minlength=n_users * n_types * n_days
+        ).astype(np.int64).reshape(n_users, n_types, n_days)
+        self.cumulative = np.cumsum(daily, axis=2)
+
+    def totals(self, n_days: int) -> np.ndarray:
+        """
+        支払日から n_days 日間のラン数合計を、(ユーザー数, ラン種別数) の配列で返します。
+        """
+        if not 0 <= n_days <= self.max_days:
+            raise ValueError(f'n_days must be between 0 and {self.max_days}')
+        upper = self.cumulative[:, :, n_days]
+        lower = np.where(self.start_offset[:, None] > 0, self.cumulative[:, :, 0], 0)
+        return upper - lower
+
+    def totals_frame(self, n_days: int) -> pd.DataFrame:
+        """
+        支払日から n_days 日間のラン種別ごとの合計と Run Count Total を、UID をインデックスとするDataFrameで返します。
+        """
+        totals = self.totals(n_days)
+        frame = pd.DataFrame(totals, index=self.uids, columns=self.run_types)
+        frame['Run Count Total'] = totals.sum(axis=1)
+        return frame
+
+    def cumulative_curves(self, max_day: int) -> np.ndarray:
+        """
+        0日目から max_day 日目までの各日数 n について「支払日から n 日間のラン数合計」を並べた、
+        (ユーザー数, ラン種別数, max_day + 1) の配列を返します。
+        """
+        if not 0 <= max_day <= self.max_days:
+            raise ValueError(f'max_day must be between 0 and {self.max_days}')
+        lower = np.where(self.start_offset[:, None] > 0, self.cumulative[:, :, 0], 0)
+        return self.cumulative[:, :, :max_day + 1] - lower[:, :, None]
+
+    def horizon_totals(self, horizons: List[int]) -> Dict[int, np.ndarray]:
+        """
+        複数の期間について、ユーザーごとのラン数合計(全ラン種別の合計)を返します。
+        """
+        return {n_days: self.totals(n_days).sum(axis=1) for n_days in horizons}
+
+
+COHORT_PERIODS = {'week': 'W', 'month': 'M'}
+
+def cohort_curves(users: pd.DataFrame, payment_window: PaymentWindowTotals, period: str, max_day: int, split_by: List[str], as_of: pd.Timestamp) -> pd.DataFrame:
+    """
+    支払日の週または月ごとにユーザーをコホートに分け、1ユーザーあたりの累積ラン数の推移(0日目〜max_day日目)を求めます。
+
+    as_of 時点でまだ経過していない日数の値は、そのユーザーについては欠損として扱い平均から除外します。
+
+    Args:
+        users (pd.DataFrame): PaymentWindowTotals の構築に使った、UID, Payment Date, Plan 列を持つDataFrame。
+        payment_window (PaymentWindowTotals): 支払日起点の累積和。
+        period (str): 'week' または 'month'。
+        max_day (int): 求める最大の経過日数。
+        split_by (List[str]): コホートに加えて分割する軸。'Plan' と 'Run Type' を指定できます。
+        as_of (pd.Timestamp): 集計時点(UTC)。
+
+    Returns:
+        pd.DataFrame: (Cohort, [Plan], [Run Type]) をインデックス、経過日数を列とし、Users 列にユーザー数を持つDataFrame。
+    """
+    payment_date = pd.to_datetime(users['Payment Date'], utc=True)
+    cohort = payment_date.dt.tz_localize(None).dt.to_period(COHORT_PERIODS[period]).dt.start_time.dt.strftime('%Y-%m-%d')
+
+    curves = payment_window.cumulative_curves(max_day).astype(np.float64)
+    # as_of 時点で経過していない日は欠損にする
+    elapsed_days = (as_of.normalize() - payment_date.dt.normalize()).dt.days.to_numpy()
+    not_elapsed = np.arange(max_day + 1)[None, :] > elapsed_days[:, None]
+    curves[np.broadcast_to(not_elapsed[:, None, :], curves.shape)] = np.nan
+
+    keys = {'Cohort': cohort.to_numpy()}
+    if 'Plan' in split_by:
+        keys['Plan'] = users['Plan'].to_numpy()
+
+    run_types = payment_window.run_types
+    if 'Run Type' in split_by:
+        n_types = len(run_types)
+        keys = {name: np.repeat(values, n_types) for name, values in keys.items()}
+        keys['Run Type'] = np.tile(run_types, len(users))
+        values = curves.reshape(len(users) * n_types, max_day + 1)
+    else:
+        # 全ラン種別の合計(欠損はラン種別間で共通)
+        values = curves.sum(axis=1)
+
+    frame = pd.DataFrame(values, columns=range(max_day + 1))
+    group_keys = [pd.Series(values, name=name) for name, values in keys.items()]
+    grouped = frame.groupby(group_keys, sort=True)
+    matrix = grouped.mean()
+    matrix.insert(0, 'Users', grouped.size())
+    return matrix
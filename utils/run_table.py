@@ -0,0 +1,95 @@
+# utils/run_table.py
+
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Iterable, List, Tuple
+from domain.performance import RUN_TYPE_LABELS
+
+RUN_TABLE_COLUMNS = ['UID', 'Date', 'Run Type', 'Count']
+CATEGORICAL_COLUMNS = [
+    'UID', 'Run Type', 'Plan', 'Billing Status',
+    'Feed Langsmith Project Name', 'Reel Langsmith Project Name',
+]
+USER_COLUMNS = [
+    'UID', 'Display Name', 'Created At', 'Plan', 'Billing Status',
+    'Feed Langsmith Project Name', 'Reel Langsmith Project Name',
+]
+
+def build_long_run_table(records: Iterable[Tuple[str, str, Dict[str, Any]]]) -> pd.DataFrame:
+    """
+    (UID, 日付, performanceデータ) のレコードを、(UID, Date, Run Type) をキーとする縦持ちのDataFrameに変換します。
+
+    Args:
+        records (Iterable[Tuple[str, str, Dict[str, Any]]]): PerformanceRepository.stream_all_runs_between などが返すレコード。
+
+    Returns:
+        pd.DataFrame: UID, Date, Run Type, Count 列を持つDataFrame。ラン数が0の行は含みません。
+    """
+    rows = []
+    for user_id, date_str, performance_data in records:
+        for run_type, label in RUN_TYPE_LABELS.items():
+            count = performance_data.get(run_type, 0)
+            if count:
+                rows.append((user_id, date_str, label, count))
+    return pd.DataFrame(rows, columns=RUN_TABLE_COLUMNS)
+
+def build_wide_run_table(runs: pd.DataFrame, users: pd.DataFrame, date_range: List[str]) -> pd.DataFrame:
+    """
+    縦持ちのラン数テーブルを、ユーザー×ラン種別ごとに1行、日付ごとに1列の横持ちのDataFrameに変換します。
+
+    行・列の位置をまとめて求めて1回の集計で行列に配置するため、ユーザー数や日数が多くてもPythonのループは発生しません。
+
+    Args:
+        runs (pd.DataFrame): UID, Date, Run Type, Count 列を持つ縦持ちのDataFrame。
+        users (pd.DataFrame): USER_COLUMNS の列を持つユーザー属性のDataFrame。行の順序が出力の順序になります。
+        date_range (List[str]): 'YYYY-MM-DD' 形式の日付のリスト。範囲外の日付のラン数は無視されます。
+
+    Returns:
+        pd.DataFrame: ユーザー属性、Run Type、日付ごとのラン数、Run Count Total 列を持つDataFrame。
+    """
+    run_types = list(RUN_TYPE_LABELS.values())
+    n_users, n_types, n_dates = len(users), len(run_types), len(date_range)
+
+    user_pos = pd.Index(users['UID']).get_indexer(runs['UID'])
+    type_pos = pd.Index(run_types).get_indexer(runs['Run Type'])
+    date_pos = pd.Index(date_range).get_indexer(runs['Date'])
+    valid = (user_pos >= 0) & (type_pos >= 0) & (date_pos >= 0)
+
+    cell = ((user_pos[valid] * n_types + type_pos[valid]) * n_dates + date_pos[valid])
+    counts = np.bincount(
+        cell,
+        weights=runs['Count'].to_numpy()[valid],
+        minlength=n_users * n_types * n_dates
+    ).astype(np.int64).reshape(n_users * n_types, n_dates)
+
+    def repeat(column):
+        return np.repeat(users[column].to_numpy(), n_types)
+
+    wide = pd.DataFrame({
+        'UID': repeat('UID'),
+        'Display Name': repeat('Display Name'),
+        'Created At': repeat('Created At'),
+        'Run Type': np.tile(run_types, n_users),
+        'Plan': repeat('Plan'),
+        'Billing Status': repeat('Billing Status'),
+        'Feed Langsmith Project Name': repeat('Feed Langsmith Project Name'),
+        'Reel Langsmith Project Name': repeat('Reel Langsmith Project Name'),
+    })
+    wide = pd.concat([wide, pd.DataFrame(counts, columns=date_range)], axis=1)
+    wide['Run Count Total'] = counts.sum(axis=1)
+    return wide
+
+def compact_wide_run_table(wide: pd.DataFrame, date_range: List[str]) -> pd.DataFrame:
+    """
+    横持ちのラン数テーブルのメモリ使用量を削減します。
+
+    値の種類が少ない文字列列をカテゴリ型に変換し、日付ごとのラン数と合計を値が収まる最小の符号なし整数型に変換します。
+    """
+    compact = wide.astype({column: 'category' for column in CATEGORICAL_COLUMNS if column in wide.columns})
+    if date_range:
+        counts = compact[date_range].to_numpy()
+        count_dtype = np.min_scalar_type(int(counts.max()) if counts.size else 0)
+        compact[date_range] = counts.astype(count_dtype)
+    total = compact['Run Count Total'].to_numpy()
+    compact['Run Count Total'] = total.astype(np.min_scalar_type(int(total.max()) if total.size else 0))
+    return compact
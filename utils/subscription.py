@@ -0,0 +1,61 @@
+# utils/subscription.py
+
+import pandas as pd
+from datetime import date
+
+def daily_active_subscriptions(billing: pd.DataFrame, start_date: date, end_date: date) -> pd.DataFrame:
+    """
+    billing レコードから、日ごと・プランごとの契約中のユーザー数を求めます。
+
+    各レコードを [payment_date, 終了日) の区間とみなし、開始日に+1、終了日に-1 のイベントを
+    日付順に累積することで、レコード数によらず一度の集計で全期間の値を求めます。
+    更新のたびに billing が作られるため、終了日は cancellation_date と同じユーザーの次の payment_date のうち早い方とし、
+    1人のユーザーを同じ日に2回以上数えないようにします。
+    cancellation_date のない 'cancelled' のレコードは解約日が分からないため数えません。
+    payment_date のないレコードと、status が 'pending' のレコードも数えません。
+
+    Args:
+        billing (pd.DataFrame): user_id, plan, status, payment_date, cancellation_date 列を持つDataFrame。
+        start_date (date): 集計の開始日。
+        end_date (date): 集計の終了日(この日を含む)。
+
+    Returns:
+        pd.DataFrame: 日付をインデックス、プランを列とする契約中のユーザー数のDataFrame。
+    """
+    dates = pd.date_range(start_date, end_date, tz='UTC')
+
+    billing = billing[billing['payment_date'].notna() & (billing['status'] != 'pending')]
+    billing = billing.assign(
+        start_day=pd.to_datetime(billing['payment_date'], utc=True).dt.normalize(),
+        cancel_day=pd.to_datetime(billing['cancellation_date'], utc=True).dt.normalize(),
+    ).sort_values(['user_id', 'start_day'], kind='stable')
+    # 同じユーザーの次の billing が始まった日に、前の billing の区間を終える
+    next_start_day = billing.groupby('user_id', sort=False)['start_day'].shift(-1)
+    end_day = pd.concat([billing['cancel_day'], next_start_day], axis=1).min(axis=1)
+    # 解約日の分からない解約済みのレコードは、開始日に終えて数えない
+    end_day = end_day.mask((billing['status'] == 'cancelled') & billing['cancel_day'].isna(), billing['start_day'])
+    start_day = billing['start_day']
+    end_day = end_day.where(end_day.isna() | (end_day > start_day), start_day)
+    plan = billing['plan'].fillna('None')
+
+    events = pd.concat([
+        pd.DataFrame({'plan': plan, 'day': start_day, 'delta': 1}),
+        pd.DataFrame({'plan': plan, 'day': end_day, 'delta': -1}).dropna(subset=['day']),
+    ], ignore_index=True)
+    # 集計期間より前のイベントは開始日にまとめ、終了日より後のイベントは除外する
+    events['day'] = events['day'].clip(lower=dates[0])
+    events = events[events['day'] <= dates[-1]]
+
+    deltas = events.groupby(['day', 'plan'])['delta'].sum().unstack('plan', fill_value=0)
+    active = deltas.reindex(dates, fill_value=0).cumsum()
+    active.index = active.index.tz_localize(None).date
+    active.index.name = 'Date'
+    active.columns.name = None
+    return active.astype(int)
+
+def plan_mix(active: pd.DataFrame) -> pd.DataFrame:
+    """
+    日ごとの有効な契約数を、プランごとの構成比に変換します。契約が0件の日はすべて0になります。
+    """
+    totals = active.sum(axis=1)
+    return active.div(totals.where(totals > 0), axis=0).fillna(0.0)